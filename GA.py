@@ -11,6 +11,13 @@ from os import system
 
 import crossover
 import mutation
+import operators
+import generation
+import distance
+import loader
+import cache
+import kernels
+import localsearch
 
 from datetime import datetime
 import logging
@@ -26,10 +33,8 @@ CONFIG.read('controller.ini')
 
 #Calculators
 numberOfCities = 0
-totalFitness = 0
 genEvolved = 0
 
-loc_multiplier = math.pi / 180
 
 
 #Result Store
@@ -46,6 +51,11 @@ e_t = 0.0
 ex_time = 0.0
 scale_factor = 0.000125
 
+#Nearest neighbour candidate lists, None when disabled
+candidates = None
+fitness_cache = None          #Memo of evaluated tour lengths, None when disabled
+population = None             #generation.Population being evolved
+
 
 def printProgressBar (iteration, total, prefix = '', suffix = '', decimals = 1, length = 100, fill = '█', printEnd = "\r"):
     # Print iterations progress
@@ -53,103 +63,42 @@ def printProgressBar (iteration, total, prefix = '', suffix = '', decimals = 1,
     percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
     filledLength = int(length * iteration // total)
     bar = fill * filledLength + '-' * (length - filledLength)
-    print('\r{} {} |{}| {}% {} CURR_MIN_DIST={:.2f}'.format(prefix,iteration, bar, percent, suffix, minDist/scale_factor), end = printEnd )
+    print('\r{} {} |{}| {}% {} CURR_MIN_DIST={:.2f}'.format(prefix,iteration, bar, percent, suffix, population.minDist/scale_factor), end = printEnd )
     # Print New Line on Complete
     if iteration == total: 
         print("\n")
 
  
-def addCity_using_coords():
-    
-    global numberOfCities, cityCoord,distanceMatrix, s_t, e_t
+def loadDataset():
+
+    global s_t, e_t, numberOfCities, cityCoord, distanceMatrix, candidates, fitness_cache
 
     s_t = time()
 
-    cityCoord = []
     try:
-        with open(str(data_fname), "r") as f:
-            for line in f:
-                i, x, y = line.split()
-                cityCoord.append([float(x)*scale_factor,float(y)*scale_factor])  #Convert to float for accuracy
-                   #Initiating pandas dataframe
-        numberOfCities =  len(cityCoord) 
-
-        if numberOfCities > 0:
-            distanceMatrix = []
-            logger.info("Successfully added {cit} cities from data.".format(cit = numberOfCities))
-            generateDistMatrix()
-    except:
-        logger.warning("Dataset could not be loaded")
+        instance = loader.read(data_settings)
+    except (OSError, ValueError) as err:
+        logger.warning("Dataset could not be loaded: {}".format(err))
         sys.exit()
-    #print(cityCoord, numberOfCities)
-    
-
-def addCity_using_dist():
-    
-    global distanceMatrix, numberOfCities, s_t, e_t
-    s_t = time()
-
-    dist_row = []
-    with open(str(data_fname), "r") as f:
-        
-        distanceMatrix = []
-
-        for line in f:
-            for val in line.split():
-                dist_row.append(float(val * scale_factor))
-
-                
-            distanceMatrix.append (temp_dist)
-            dist_row = [] 
 
+    numberOfCities = instance.dimension
     logger.info("Successfully added {cit} cities from data.".format(cit = numberOfCities))
+    if not instance.explicit:
+        cityCoord = instance.coords
+    distanceMatrix = loader.distances(instance, data_settings, scale_factor, logger)
     e_t = time()
     logger.info("CPU took {} to complete data loading and distance matrix building".format(e_t-s_t))
 
+    candidates = loader.candidates(instance, distanceMatrix, data_settings, logger)
 
-def generateDistMatrix():
-
-    global distanceMatrix, s_t, e_t
-    global numberOfCities
-    
-
-    def deg2rad(deg):
-        return deg * loc_multiplier
+    if fitness_cache_size > 0:
+        fitness_cache = cache.TourCache(fitness_cache_size, distanceMatrix.symmetric)
 
 
-    for i in range(numberOfCities):
-        temp_dist = []
-        for j in range(numberOfCities):  #Generating entire matrix. Can be optimized by generating upward triangle matrix
-            a = cityCoord[i]
-            b = cityCoord[j]   
-        
-
-            if (data_cordinate == True):
-                distance = math.sqrt(math.pow(b[0]-a[0], 2) + math.pow(b[1] - a[1], 2 ))
-                temp_dist.append(float(distance))   #Using python list comprehension for better performance
-            else:
-                R = 6371 #Radius of the earth in km
-                lat1 = a[0]
-                lat2 = b[0]
-                long1 = a[1]
-                long2 = b[1]
-                dLat = deg2rad(lat2-lat1) 
-                dLon = deg2rad(long2-long1)
-                a = math.sin(dLat/2) * math.sin(dLat/2) + math.cos(deg2rad(lat1)) * math.cos(deg2rad(lat2)) * math.sin(dLon/2) * math.sin(dLon/2)
-                c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-                distance = R * c
-                temp_dist.append(float(distance))
-    
-        distanceMatrix.append (temp_dist)
-
-    e_t = time()
-    logger.info("CPU took {} to complete data loading and distance matrix building".format(e_t-s_t))
-    #print(distanceMatrix)
-  
-
 def generateInitPop():
-    global numberOfCities, populationSize, populationMatrix
+    global numberOfCities, populationSize, population
     
+    populationMatrix = []
     pop = list(range(numberOfCities))
     pop.append(0)
 
@@ -165,113 +114,20 @@ def generateInitPop():
         populationMatrix.append(pop_t)
         pop = pop_t.copy()
 
+    population = generation.Population(populationMatrix, distanceMatrix, crossover_operator, mutation_operator, mutationRate,
+                                       candidates=candidates, fitnessCache=fitness_cache, sel=sel_opt, tournamentSize=tournament_size,
+                                       rankPressure=rank_pressure, batch=batch_crossover, scale=scale_factor)
 
-    logger.info("{} intial chromorsome populated".format(len(populationMatrix)))
+    logger.info("{} intial chromorsome populated".format(len(population.populationMatrix)))
 
 
-    if (len(populationMatrix) == populationSize):
+    if (len(population.populationMatrix) == populationSize):
         logger.info("Initial population generated successfully")
-        calculateFitness()
-
-
-def matingPoolSelection():
-    #Using Roulette wheel selection we will assign probabilities from 0-1 to 
-    #each individual. The probability will determine how often we select a fit individual
-    
-    global totalFitness, fitnessMatrix
-
-    index = 0
-    r = random.random()
-
-    while( r > 0):
-        r = r - fitnessMatrix[index]
-        index += 1 
-    
-    index -= 1
-
-    return populationMatrix[index].copy()
-    
-
-def calculateFitness():
-    global totalFitness, fitnessMatrix, minDist, fitness_curve, bestRoute, nextGenerationMatrix, generation_fitness
-
-    fitnessMatrix.clear()
-
-    for individual in populationMatrix:
-        distance = 0
-        for j in range(len(individual)-1):
-            distance += distanceMatrix[individual[j]][individual[j+1]]
-
-        fitnessMatrix.append( 1 / distance )  #For routes with smaller distance to have highest fitness
-
-        if distance < minDist:
-            minDist = distance
-            bestRoute = individual.copy()
-             
-    fitness_curve.append(round(minDist  / scale_factor, 4))
-
-    totalFitness = sum(fitnessMatrix)
-    fitnessMatrix = [x / totalFitness for x in fitnessMatrix]      #Normalizing the fitness values between [0-1]
-
-    #generation_fitness.loc[len(generation_fitness)] = fitnessMatrix
-
-
-
-
-def mutateChild(gene):
-    global mutationRate, mt_opt
-    r = random.random()
-    if r < mutationRate:
-        if (mt_opt == "RSM"):
-            return mutation.RSM(gene)
-        else: 
-            return mutation.Twors(gene)
-
-def nextGeneration():
-    global nextGenerationMatrix, populationMatrix, genCount, bestRoute
-    
-    
-    nextGenerationMatrix.append(bestRoute)      #Elitism, moving the fittest gene to the new generation as is
-    nextGenerationMatrix.append(bestRoute) 
-
-    while (len(nextGenerationMatrix) < populationSize):
-
-        parentA = matingPoolSelection()
-        parentB = matingPoolSelection()
-
-        #Crossover Probability
-        r = random.random()
-
-        if r < 0.8:
-            if (cx_opt == "OC_Single"):
-                childA, childB = crossover.OC_Single(parentA, parentB)
-            elif (cx_opt == "cycleCrossover"):
-                childA, childB = crossover.cycleCrossover(parentA, parentB)
-            elif (cx_opt == "OC_Multi"):
-                childA, childB = crossover.OC_Multi(parentA, parentB)
-            elif (cx_opt == "PMS"):
-                childA, childB = crossover.PMS(parentA, parentB)
-            else:
-                logger.warning("Unknown crossover operator configured.")
-                logger.warning("Model cannot be executed")
-                sys.exit()
-
-            mutateChild(childA)
-            mutateChild(childB)
-
-            nextGenerationMatrix.append(childA)
-            nextGenerationMatrix.append(childB)
-        else:
-            nextGenerationMatrix.append(parentA)
-            nextGenerationMatrix.append(parentB)
-
-    populationMatrix = nextGenerationMatrix.copy()
-    nextGenerationMatrix.clear()
-    calculateFitness()
+        population.calculateFitness()
 
 
 def GA():
-    global nextGenerationMatrix, populationMatrix, genCount, bestRoute, dead_count, genEvolved,s_t, e_t, ex_time
+    global genCount, bestRoute, minDist, fitness_curve, dead_count, genEvolved,s_t, e_t, ex_time
 
     counter = 0
     i=0
@@ -282,17 +138,18 @@ def GA():
 
     while(True):
 
-        m = minDist
+        m = population.minDist
       
-        nextGeneration()
+        population.nextGeneration()
 
-        if(minDist == m):
+        if(population.minDist == m):
             counter += 1 
         else:
             counter = 0
             end_point = i + dead_count 
 
         if (counter == dead_count or i == genCount ):
+            minDist, bestRoute, fitness_curve = population.minDist, population.bestRoute, population.fitnessCurve
             genEvolved = len(fitness_curve)
             logger.info("\nGENERATIONS EVOLVED={gen}".format(gen=str(genEvolved)))
             e_t = time()
@@ -476,13 +333,14 @@ def logging_setup():
     logger.info("TSP USING Genetic Algorithm\nDeveloped by Jugen Gawande")
     logger.info(str(datetime.now()))
     logger.info("\nPOPULATION SIZE={pop} \nMUTATION RATE={mut} \nDATASET SELECTED={name}".format(pop =populationSize, mut = mutationRate, name = data))
+    logger.info("SELECTION OPERATOR={}".format(sel_opt))
+    logger.info("KERNEL BACKEND={}".format(kernel_backend))
 
 
 def initializeAlgorithm():
-    global data, data_type_flag, populationSize, mutationRate,mt_opt, genCount, dead_count, cx_opt, set_debug, data_cordinate, data_fname
+    global data, populationSize, mutationRate, mt_opt, genCount, dead_count, cx_opt, crossover_operator, mutation_operator, batch_crossover, sel_opt, tournament_size, rank_pressure, set_debug, data_settings, scale_factor, fitness_cache_size, kernel_backend, local_polish
 
     data = CONFIG['DATASET']['FILE_NAME']
-    data_type_flag = CONFIG.getint('DATASET', 'DATASET_TYPE')
     populationSize = CONFIG.getint('GENETIC', 'POP_SIZE')
     if (populationSize < 1):
         logger.warning("Population size not enough")
@@ -491,11 +349,39 @@ def initializeAlgorithm():
     genCount = CONFIG.getint('GENETIC', 'GEN_COUNT')
     dead_count = CONFIG.getint('GENETIC', 'DEAD_COUNTER')
     cx_opt = CONFIG['OPERATOR']['CROSSOVER_OPERATOR']
+    crossover_operator = operators.resolve('crossover', cx_opt)
+    if crossover_operator is None:
+        #Runs before the logger exists
+        print("Unknown crossover operator configured: {}".format(cx_opt))
+        print("Model cannot be executed")
+        sys.exit(1)
+    batch_crossover = CONFIG.getboolean('OPERATOR', 'BATCH_CROSSOVER', fallback=False)
+    sel_opt = CONFIG.get('OPERATOR', 'SELECTION_OPERATOR', fallback='roulette')
+    if sel_opt not in generation.SELECTIONS:
+        print("Unknown selection operator configured: {}".format(sel_opt))
+        print("Model cannot be executed")
+        sys.exit(1)
+    tournament_size = CONFIG.getint('OPERATOR', 'TOURNAMENT_SIZE', fallback=3)
+    rank_pressure = CONFIG.getfloat('OPERATOR', 'RANK_PRESSURE', fallback=1.5)
     mt_opt = CONFIG['OPERATOR']['MUTATION_OPERATOR']
+    mutation_operator = operators.resolve('mutation', mt_opt)
+    if mutation_operator is None:
+        print("Unknown mutation operator configured: {}".format(mt_opt))
+        print("Model cannot be executed")
+        sys.exit(1)
     set_debug = CONFIG.getboolean('DEBUG', 'LOG_FILE')
-    data_cordinate = CONFIG.getboolean('DATASET','CONTAINS_COORDINATES')
+    data_settings = loader.Settings(CONFIG)
+    if distance.isInteger(data_settings.dtype):
+        scale_factor = 1     #TSPLIB rounding works on unscaled distances
+    fitness_cache_size = CONFIG.getint('GENETIC', 'FITNESS_CACHE', fallback=10000)
+    try:
+        kernel_backend = kernels.use(CONFIG.get('KERNELS', 'BACKEND', fallback='auto'))
+    except ValueError as err:
+        print(err)
+        print("Model cannot be executed")
+        sys.exit(1)
+    local_polish = CONFIG.getboolean('LOCAL SEARCH', 'POLISH', fallback=False)
 
-    data_fname = "./dataset/" + data + ".txt"
 
 
 
@@ -505,25 +391,28 @@ if __name__ == '__main__':
     logging_setup()
 
 
-    if data_type_flag == 0:
-        addCity_using_coords()
-
-    else:
-        addCity_using_dist()
+    loadDataset()
 
     #Initialize pandas dataframes
-    fitnessMatrix = []
     generation_fitness = pd.DataFrame(columns = np.arange(populationSize))
-    populationMatrix = []
-    nextGenerationMatrix = []
 
     #Run Genetic Algorithm
     generateInitPop()
     GA()
 
+    if local_polish:
+        #2-opt over the candidate edges to finish off the best tour
+        bestRoute, gain = localsearch.twoOpt(bestRoute, distanceMatrix, candidates)
+        minDist = distanceMatrix.tour(bestRoute)
+        logger.info("LOCAL SEARCH: 2-opt saved {}".format(gain / scale_factor))
+
 
     #logger.info("FITNESS CURVE:\n{}".format(fitness_curve[:len(fitness_curve)-98])) 
     logger.info("MINIMAL DISTANCE={}".format(minDist / scale_factor))
+    if fitness_cache is not None:
+        logger.info("FITNESS CACHE: {}".format(fitness_cache.summary()))
+    for line in operators.summary(scale_factor):
+        logger.info("OPERATOR {}".format(line))
     logger.info("BEST ROUTE FOUND={}".format(bestRoute))
     logger.info("\nAlgorithm Completed Successfully.")
       #Will fail if all generations are exhausted
@@ -11,6 +11,13 @@ from os import system
 
 import crossover
 import mutation
+import operators
+import generation
+import distance
+import loader
+import neighbours
+import cache
+import kernels
 
 from datetime import datetime
 import logging
@@ -34,10 +41,8 @@ CONFIG.read('controller.ini')
 
 #Calculators
 numberOfCities = 0
-totalFitness = 0
 genEvolved = 0
 
-loc_multiplier = math.pi / 180
 
 #Result Store
 minDist = math.inf
@@ -55,102 +60,37 @@ e_t = 0.0
 ex_time = 0.0
 scale_factor = 0.000125
 
+#Nearest neighbour candidate lists, None when disabled
+candidates = None
+fitness_cache = None          #Memo of evaluated tour lengths, None when disabled
+population = None             #generation.Population being evolved
 
 
-def addCity_using_coords():
 
-    global numberOfCities, cityCoord,distanceMatrix, s_t, e_t
+def loadDataset():
+
+    global s_t, e_t, numberOfCities, cityCoord, distanceMatrix, candidates, fitness_cache
 
     s_t = time()
-    cityCoord = []
 
     try:
-        with open(str(data_fname), "r") as f:
-            for line in f:
-                i, x, y = line.split()
-                cityCoord.append([float(x)*scale_factor,float(y)*scale_factor])  #Convert to float for accuracy
-
-        numberOfCities =  len(cityCoord)
-
-        if numberOfCities > 0:
-            distanceMatrix = []
-            logger.info("Successfully added {cit} cities from data.".format(cit = numberOfCities))
-            generateDistMatrix()
-
-    except:
-        logger.warning("Dataset could not be loaded")
+        instance = loader.read(data_settings)
+    except (OSError, ValueError) as err:
+        logger.warning("Dataset could not be loaded: {}".format(err))
         sys.exit()
 
-
-def addCity_using_dist():
-
-    global distanceMatrix, numberOfCities, s_t, e_t
-
-    s_t = time()
-    dist_row = []
-
-    with open(str(data_fname), "r") as f:
-
-   
-        for line in f:
-            for val in line.split():
-                dist_row.append(float(val))
-    
-            distanceMatrix.append (dist_row)
-            dist_row = []
-
-        numberOfCities = len(distanceMatrix[0])
-
-
+    numberOfCities = instance.dimension
     logger.info("Successfully added {cit} cities from data.".format(cit = numberOfCities))
-
+    if not instance.explicit:
+        cityCoord = instance.coords
+    distanceMatrix = loader.distances(instance, data_settings, scale_factor, logger)
     e_t = time()
     logger.info("CPU took {} to complete data loading and distance matrix building".format(e_t-s_t))
 
+    candidates = loader.candidates(instance, distanceMatrix, data_settings, logger)
 
-def generateDistMatrix():
-
-    global distanceMatrix, s_t, e_t
-    global numberOfCities
-
-
-    def deg2rad(deg):
-        return deg * loc_multiplier
-
-
-    for i in range(numberOfCities):
-        dist_row = []
-
-        for j in range(i):  #Generating entire matrix. Can be optimized by generating upward triangle matrix
-            a = cityCoord[i]
-            b = cityCoord[j]
-
-            #Find Euclidean distance between points
-
-            if (data_cordinate == True):
-                distance = math.sqrt(math.pow(b[0]-a[0], 2) + math.pow(b[1] - a[1], 2 ))
-                dist_row.append(float(distance))   #Using python list comprehension for better performance
-
-            else:
-                R = 6371 #Radius of the earth in km
-                lat1 = a[0]
-                lat2 = b[0]
-                long1 = a[1]
-                long2 = b[1]
-                dLat = deg2rad(lat2-lat1)
-                dLon = deg2rad(long2-long1)
-                a = math.sin(dLat/2) * math.sin(dLat/2) + math.cos(deg2rad(lat1)) * math.cos(deg2rad(lat2)) * math.sin(dLon/2) * math.sin(dLon/2)
-                c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-                distance = R * c
-
-                dist_row.append(float(distance))
-
-        distanceMatrix.append (dist_row)
-
-    e_t = time()
-    logger.info("CPU took {} to complete data loading and distance matrix building".format(e_t-s_t))
-
-    # print(distanceMatrix)
+    if fitness_cache_size > 0:
+        fitness_cache = cache.TourCache(fitness_cache_size, distanceMatrix.symmetric)
 
 
 def findChromo(pop ):
@@ -167,9 +107,10 @@ def findChromo(pop ):
 threads = []
 
 def generateInitPop():
-    global numberOfCities, populationSize, threads
+    global numberOfCities, populationSize, population, threads
 
 
+    populationMatrix = []
     pop = list(range(numberOfCities))
     pop.append(0)
 
@@ -185,151 +126,39 @@ def generateInitPop():
         populationMatrix.append(pop_t)
         pop = pop_t.copy()
 
+    #Two places of every generation are left to the SA results
+    population = generation.Population(populationMatrix, distanceMatrix, crossover_operator, mutation_operator, mutationRate,
+                                       size=populationSize-2, candidates=candidates, fitnessCache=fitness_cache, sel=sel_opt,
+                                       tournamentSize=tournament_size, rankPressure=rank_pressure, batch=batch_crossover,
+                                       scale=scale_factor, precision=2)
 
-    logger.info("{} intial chromorsome populated".format(len(populationMatrix)))
+    logger.info("{} intial chromorsome populated".format(len(population.populationMatrix)))
 
-    if (len(populationMatrix) == populationSize):
+    if (len(population.populationMatrix) == populationSize):
         logger.info("Initial population generated successfully")
 
-        calculateFitness()
+        population.calculateFitness()
 
  
-def matingPoolSelection():
-    #Using Roulette wheel selection we will assign probabilities from 0-1 to
-    #each individual. The probability will determine how often we select a fit individual
-
-    global totalFitness, fitnessMatrix
-
-    index = 0
-    r = random.random()
-
-    while( r > 0):
-        r = r - fitnessMatrix[index]
-        index += 1
-
-    index -= 1
-
-    return populationMatrix[index].copy()
-
-
-def calculateFitness():
-    global totalFitness, fitnessMatrix, minDist, fitness_curve, bestRoute, generation_fitness
-
-    fitnessMatrix =[]
-
-    for individual in populationMatrix:
-   
-        distance = 0
-        for j in range(len(individual)-1):
-
-            if(individual[j] < individual[j+1]):
-                distance += distanceMatrix[individual[j+1]] [individual[j]]
-            else:
-                distance += distanceMatrix [individual[j]] [individual[j+1]]
-
-        fitnessMatrix.append( 1 / distance )  #For routes with smaller distance to have highest fitness
-
-        #Updating the best distance variable when a distance that is smaller than all
-        #previous calculations is found
-
-        if distance < minDist:
-            minDist = distance
-            bestRoute = individual.copy()
-
-
-    totalFitness = sum(fitnessMatrix)
-    fitnessMatrix = [x / totalFitness for x in fitnessMatrix]      #Normalizing the fitness values between [0-1]
-
-    fitness_curve.append(round(minDist  / scale_factor, 2))
-    #generation_fitness.loc[len(generation_fitness)] = fitnessMatrix
-
-
-def mutateChild(gene):
-    global mutationRate
-
-    r = random.random()
-
-    if r < mutationRate:
-        if (mt_opt == "RSM"):
-            return mutation.RSM(gene)
-        else: 
-            return mutation.Twors(gene)
-
-
-def nextGeneration():
-    global nextGenerationMatrix, populationMatrix, genCount, bestRoute
-  
-    nextGenerationMatrix.append (bestRoute)     #Elitism, moving the fittest gene to the new generation as is
-    nextGenerationMatrix.append (bestRoute)
-
-    while (len(nextGenerationMatrix) < populationSize-2):
-
-        parentA = matingPoolSelection()
-        parentB = matingPoolSelection()
-
-        #Crossover Probability
-        r = random.random()
-
-        if r < 0.8:
-            if (cx_opt == "OC_Single"):
-                childA, childB = crossover.OC_Single(parentA, parentB)
-            elif (cx_opt == "cycleCrossover"):
-                childA, childB = crossover.cycleCrossover(parentA, parentB)
-            elif (cx_opt == "OC_Multi"):
-                childA, childB = crossover.OC_Multi(parentA, parentB)
-            elif (cx_opt == "PMS"):
-                childA, childB = crossover.PMS(parentA, parentB)
-            else:
-                logger.warning("Unknown crossover operator configured.")
-                logger.warning("Model cannot be executed")
-                sys.exit()
-
-            mutateChild(childA)
-            mutateChild(childB)
-
-            nextGenerationMatrix.append(childA)
-            nextGenerationMatrix.append(childB)
-        else:
-            nextGenerationMatrix.append(parentA)
-            nextGenerationMatrix.append(parentB)
-
-    populationMatrix = nextGenerationMatrix.copy()
-    nextGenerationMatrix.clear()
-    calculateFitness()
-
-
 def calculateSolutionFitness(arr):
- 
-    distance = 0
-    for j in range(len(arr)-1):
-
-        if(arr[j] < arr[j+1]):
-            distance += distanceMatrix[arr[j+1]][arr[j]]
-        else:
-            distance += distanceMatrix[arr[j]][arr[j+1]]
-
-    return (distance)
+    return (distanceMatrix.tour(arr))
 
 
 
 def reverse(arr, a, b):
+    #Reversal is only used on symmetric matrices, so just the two edges around the
+    #segment change
+    d = distanceMatrix.d
 
-    x = arr[:a].copy()
-    y = arr[a:b+1].copy()
-    z = arr[b+1:].copy()
-
-    w = y[::-1].copy()
+    x = arr[:a]
+    w = arr[a:b+1][::-1]
+    z = arr[b+1:]
 
     if (b != len(arr)-1):
-
-        s = calculateSolutionFitness([arr[a-1], *y, arr[b+1]])
-        s_dash = calculateSolutionFitness([arr[a-1], *w , arr[b+1]])
+        del_e = (d(arr[a-1], arr[b]) + d(arr[a], arr[b+1])) - (d(arr[a-1], arr[a]) + d(arr[b], arr[b+1]))
 
     else:
-        s =  calculateSolutionFitness([arr[a-1], *y])
-        s_dash = calculateSolutionFitness([arr[a-1],*w])
-
-    del_e = s_dash - s
+        del_e = d(arr[a-1], arr[b]) - d(arr[a-1], arr[a])
 
     if(del_e < 0):
   
@@ -386,12 +215,64 @@ def transport(arr, a, b):
     else: return(arr)
 
 
+def exchange(arr, i, j, k):
+    #Swap the adjacent blocks arr[i..j] and arr[j+1..k] without reversing either
+    del_e = distance.exchangeDelta(distanceMatrix, arr, i, j, k)
+
+    if(del_e < 0):
+        return [*arr[:i], *arr[j+1:k+1], *arr[i:j+1], *arr[k+1:]]
+
+    elif(del_e > 0):
+        pr = math.exp((-del_e) / (T) )
+        a = random.random()
+
+        if (pr > a):
+            return [*arr[:i], *arr[j+1:k+1], *arr[i:j+1], *arr[k+1:]]
+
+        else: return (arr)
+
+    else: return(arr)
+
+
+def segmentNeighbor(arr):
+    #Moves for asymmetric instances, reversing a segment would change the cost of
+    #every edge inside it
+    size = len(arr)
+
+    if random.random() > 0.5:
+        #Or-opt, move up to three cities to after position p
+        a = random.randint(1, size-2)
+        b = min(a + random.randint(0, 2), size-2)
+        p = random.randint(0, size-2)
+
+        if p > b:
+            return (exchange(arr, a, b, p))
+        elif p < a-1:
+            return (exchange(arr, p+1, a-1, b))
+        else: return (arr)
+
+    else:
+        #3-opt segment exchange
+        i, j, k = sorted(random.sample(range(1, size-1), 3))
+        return (exchange(arr, i, j, k))
+
+
 def testNeighbor(arr):
     r = random.random()
     size = len(arr)
 
-    a = random.randint(1,size-4)
-    b = random.randint(a+1, size-2)
+    if not distanceMatrix.symmetric:
+        return (segmentNeighbor(arr))
+
+    segment = None
+    if candidates is not None:
+        segment = neighbours.candidateSegment(arr, candidates)
+
+    if segment is not None:
+        a, b = segment
+    else:
+        a = random.randint(1,size-4)
+        b = random.randint(a+1, size-2)
 
     newarr = []
 
@@ -407,11 +288,11 @@ def SA():
     global T
 
     solution_set = []
-    arr = bestRoute.copy()
+    arr = population.bestRoute.copy()
     
     # while(accepted >= endp):
     k=0
-    m = minDist 
+    m = population.minDist 
     while(k != 20):
         accepted = 0
         # for i in range(50*len(arr)):
@@ -436,44 +317,49 @@ def SA():
 
 
 def GA():
-    global nextGenerationMatrix, populationMatrix, bestRoute, dead_count, genEvolved,s_t, e_t, switch, minDist, ex_time
+    global bestRoute, dead_count, genEvolved,s_t, e_t, switch, minDist, fitness_curve, ex_time
 
     counter = 0
     i=0
     end = False
 
     while(i < genCount):
-        m = minDist
+        m = population.minDist
    
-        nextGeneration()
+        population.nextGeneration()
 
-        if(minDist == m):
+        if(population.minDist == m):
             counter += 1
 
         else:
-            print("\r","Gen: ",i," ",minDist / scale_factor, end = "\r")
+            print("\r","Gen: ",i," ",population.minDist / scale_factor, end = "\r")
             counter = 0
 
 
         if (counter == dead_count):
             ans, h = SA()
-            nextGenerationMatrix.clear()
-            nextGenerationMatrix.extend(ans)
+            #The SA solutions are carried into the next generation
+            population.nextGenerationMatrix.clear()
+            population.nextGenerationMatrix.extend(ans)
+            population.nextGenerationLengths.clear()
+            population.nextGenerationLengths.extend([None] * len(ans))
             counter = 0
-            calculateFitness()
+            population.calculateFitness()
    
             if (h >= m):
                 end = True
                
 
         if(end == True):
-            genEvolved = len(fitness_curve)
+            genEvolved = len(population.fitnessCurve)
             logger.info("\nGENERATIONS EVOLVED={gen}".format(gen=str(genEvolved)))
             break
         
         else:
             i+=1
 
+    minDist, bestRoute, fitness_curve = population.minDist, population.bestRoute, population.fitnessCurve
+
 
 #Graphing
 def graphing():
@@ -608,6 +494,8 @@ def loggingSetup():
     logger.info("TSP USING Genetic Algorithm\nDeveloped by Jugen Gawande")
     logger.info(str(datetime.now()))
     logger.info("\nPOPULATION SIZE={pop} \nMUTATION RATE={mut} \nDATASET SELECTED={name}".format(pop =populationSize, mut = mutationRate, name = data))
+    logger.info("SELECTION OPERATOR={}".format(sel_opt))
+    logger.info("KERNEL BACKEND={}".format(kernel_backend))
 
 
 def outputRecord():
@@ -639,10 +527,9 @@ def outputRecord():
 
 #Controller Variables
 def initializeAlgorithm():
-    global data, data_type_flag, populationSize, mutationRate, mt_opt, genCount, dead_count, cx_opt, set_debug, data_cordinate, data_fname
+    global data, populationSize, mutationRate, mt_opt, genCount, dead_count, cx_opt, crossover_operator, mutation_operator, batch_crossover, sel_opt, tournament_size, rank_pressure, set_debug, data_settings, scale_factor, fitness_cache_size, kernel_backend
 
     data = CONFIG['DATASET']['FILE_NAME']
-    data_type_flag = CONFIG.getint('DATASET', 'DATASET_TYPE')
     populationSize = CONFIG.getint('GENETIC', 'POP_SIZE')
     if (populationSize < 1):
         logger.warning("Population size not enough")
@@ -651,11 +538,38 @@ def initializeAlgorithm():
     genCount = CONFIG.getint('GENETIC', 'GEN_COUNT')
     dead_count = CONFIG.getint('GENETIC', 'DEAD_COUNTER')
     cx_opt = CONFIG['OPERATOR']['CROSSOVER_OPERATOR']
+    crossover_operator = operators.resolve('crossover', cx_opt)
+    if crossover_operator is None:
+        #Runs before the logger exists
+        print("Unknown crossover operator configured: {}".format(cx_opt))
+        print("Model cannot be executed")
+        sys.exit(1)
+    batch_crossover = CONFIG.getboolean('OPERATOR', 'BATCH_CROSSOVER', fallback=False)
+    sel_opt = CONFIG.get('OPERATOR', 'SELECTION_OPERATOR', fallback='roulette')
+    if sel_opt not in generation.SELECTIONS:
+        print("Unknown selection operator configured: {}".format(sel_opt))
+        print("Model cannot be executed")
+        sys.exit(1)
+    tournament_size = CONFIG.getint('OPERATOR', 'TOURNAMENT_SIZE', fallback=3)
+    rank_pressure = CONFIG.getfloat('OPERATOR', 'RANK_PRESSURE', fallback=1.5)
     mt_opt = CONFIG['OPERATOR']['MUTATION_OPERATOR']
+    mutation_operator = operators.resolve('mutation', mt_opt)
+    if mutation_operator is None:
+        print("Unknown mutation operator configured: {}".format(mt_opt))
+        print("Model cannot be executed")
+        sys.exit(1)
     set_debug = CONFIG.getboolean('DEBUG', 'LOG_FILE')
-    data_cordinate = CONFIG.getboolean('DATASET','CONTAINS_COORDINATES')
+    data_settings = loader.Settings(CONFIG)
+    if distance.isInteger(data_settings.dtype):
+        scale_factor = 1     #TSPLIB rounding works on unscaled distances
+    fitness_cache_size = CONFIG.getint('GENETIC', 'FITNESS_CACHE', fallback=10000)
+    try:
+        kernel_backend = kernels.use(CONFIG.get('KERNELS', 'BACKEND', fallback='auto'))
+    except ValueError as err:
+        print(err)
+        print("Model cannot be executed")
+        sys.exit(1)
 
-    data_fname = "./dataset/" + data + ".txt"
 
 
 
@@ -664,11 +578,7 @@ if __name__ == '__main__':
     initializeAlgorithm()
     loggingSetup()
 
-    if data_type_flag == 0:
-        addCity_using_coords()
-
-    else:
-        addCity_using_dist()
+    loadDataset()
 
     res = Value('f', minDist, lock=False )
     p = numberOfCities + 1 
@@ -676,8 +586,6 @@ if __name__ == '__main__':
 
     #Initialize pandas dataframes
     generation_fitness = pd.DataFrame(columns = np.arange(populationSize))
-    populationMatrix = []
-    nextGenerationMatrix = []
 
     #Run Genetic Algorithm
     s_t = time()
@@ -691,6 +599,10 @@ if __name__ == '__main__':
      
     logger.info("CPU execution time: {}".format(ex_time))
     logger.info("MINIMAL DISTANCE={}".format(minDist / scale_factor))
+    if fitness_cache is not None:
+        logger.info("FITNESS CACHE: {}".format(fitness_cache.summary()))
+    for line in operators.summary(scale_factor):
+        logger.info("OPERATOR {}".format(line))
     logger.info("BEST ROUTE FOUND={}".format(bestRoute))
     logger.info("\nAlgorithm Completed Successfully.")
       #Will fail if all generations are exhausted
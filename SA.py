@@ -9,6 +9,11 @@ import pandas as pd
 
 from os import system
 
+import distance
+import loader
+import neighbours
+import localsearch
+
 
 from datetime import datetime
 import logging
@@ -26,7 +31,6 @@ CONFIG.read('controller.ini')
 numberOfCities = 0
 alpha_temp = 0.9
 
-loc_multiplier = math.pi / 180
 
 #Result Store
 minDist = math.inf
@@ -41,103 +45,33 @@ e_t = 0.0
 ex_time = 0.0
 scale_factor = 0.000125
 
+#Nearest neighbour candidate lists, None when disabled
+candidates = None
+
 cityCoord = []
 
-def addCity_using_coords():
+def loadDataset():
 
-    global numberOfCities, cityCoord,distanceMatrix, s_t, e_t
+    global s_t, e_t, numberOfCities, cityCoord, distanceMatrix, candidates
 
     s_t = time()
 
     try:
-        with open(str(data_fname), "r") as f:
-            for line in f:
-                i, x, y = line.split()
-                cityCoord.append([float(x)*scale_factor,float(y)*scale_factor])  #Convert to float for accuracy
-
-        numberOfCities =  len(cityCoord)
-
-        if numberOfCities > 0:
-            distanceMatrix = []
-            logger.info("Successfully added {cit} cities from data.".format(cit = numberOfCities))
-            generateDistMatrix()
-
-    except:
-        logger.warning("Dataset could not be loaded")
+        instance = loader.read(data_settings)
+    except (OSError, ValueError) as err:
+        logger.warning("Dataset could not be loaded: {}".format(err))
         sys.exit()
-    
-    
- 
-    #print(cityCoord, numberOfCities)
-
-
-def addCity_using_dist():
-
-    global distanceMatrix, numberOfCities, s_t, e_t
-
-    s_t = time()
-
-    
-    with open(str(data_fname), "r") as f:
-        distanceMatrix = []
-        dist_row = []
-
-        for line in f:
-            for val in line.split():
-                dist_row.append(float(val)*scale_factor)
-
-                
-            distanceMatrix.append (dist_row)
-            dist_row = []
-
-    numberOfCities = len(distanceMatrix[0])
- 
 
+    numberOfCities = instance.dimension
     logger.info("Successfully added {cit} cities from data.".format(cit = numberOfCities))
+    if not instance.explicit:
+        cityCoord = instance.coords
+    distanceMatrix = loader.distances(instance, data_settings, scale_factor, logger)
     e_t = time()
     logger.info("CPU took {} to complete data loading and distance matrix building".format(e_t-s_t))
 
+    candidates = loader.candidates(instance, distanceMatrix, data_settings, logger)
 
-def generateDistMatrix():
-
-    global distanceMatrix, s_t, e_t
-    global numberOfCities
-
-
-    def deg2rad(deg):
-        return deg * loc_multiplier
-
-    for i in range(numberOfCities):
-        temp_dist = []
-        for j in range(i):  #Generating entire matrix. Can be optimized by generating upward triangle matrix
-            a = cityCoord[i]
-            b = cityCoord[j]
-            #Find Euclidean distance between points
-
-            #distance = np.linalg.norm(a-b)
-            if (data_cordinate == True):
-                distance = math.sqrt(math.pow(b[0]-a[0], 2) + math.pow(b[1] - a[1], 2 ))
-                temp_dist.append(float(distance))   #Using python list comprehension for better performance
-
-            else:
-                R = 6371 #Radius of the earth in km
-                lat1 = a[0]
-                lat2 = b[0]
-                long1 = a[1]
-                long2 = b[1]
-                dLat = deg2rad(lat2-lat1)
-                dLon = deg2rad(long2-long1)
-                a = math.sin(dLat/2) * math.sin(dLat/2) + math.cos(deg2rad(lat1)) * math.cos(deg2rad(lat2)) * math.sin(dLon/2) * math.sin(dLon/2)
-                c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-                distance = R * c
-                temp_dist.append(float(distance))
-
-        
-        distanceMatrix.append (temp_dist)
-    
-    e_t = time()
-    logger.info("CPU took {} to complete data loading and distance matrix building".format(e_t-s_t))
-    #print(distanceMatrix)
 
 #Graphing
 def graphing():
@@ -261,34 +195,23 @@ def logging_setup():
 
 
 def calculateSolutionFitness(arr):
-    distance = 0
-    
-    for j in range(len(arr)-1):
-        if(arr[j] < arr[j+1]):
-            distance += distanceMatrix[arr[j+1]][arr[j]]
-
-        else:
-            distance += distanceMatrix[arr[j]][arr[j+1]]
-
-    return (distance)
+    return (distanceMatrix.tour(arr))
 
 
 def reverse(arr, a, b):
-    x = arr[:a].copy()
-    y = arr[a:b+1].copy()
-    z = arr[b+1:].copy()
+    #Reversal is only used on symmetric matrices, so just the two edges around the
+    #segment change
+    d = distanceMatrix.d
 
-    w = y[::-1].copy()
+    x = arr[:a]
+    w = arr[a:b+1][::-1]
+    z = arr[b+1:]
 
     if (b != len(arr)-1):
-        s = calculateSolutionFitness([arr[a-1], *y, arr[b+1]])
-        s_dash = calculateSolutionFitness([arr[a-1], *w , arr[b+1]])
+        del_e = (d(arr[a-1], arr[b]) + d(arr[a], arr[b+1])) - (d(arr[a-1], arr[a]) + d(arr[b], arr[b+1]))
 
     else:
-        s =  calculateSolutionFitness([arr[a-1], *y])
-        s_dash = calculateSolutionFitness([arr[a-1],*w])
-
-    del_e = s_dash - s
+        del_e = d(arr[a-1], arr[b]) - d(arr[a-1], arr[a])
 
     if(del_e < 0):
   
@@ -347,12 +270,64 @@ def transport(arr, a, b):
 
 
 
+def exchange(arr, i, j, k):
+    #Swap the adjacent blocks arr[i..j] and arr[j+1..k] without reversing either
+    del_e = distance.exchangeDelta(distanceMatrix, arr, i, j, k)
+
+    if(del_e < 0):
+        return [*arr[:i], *arr[j+1:k+1], *arr[i:j+1], *arr[k+1:]]
+
+    elif(del_e > 0):
+        pr = math.exp((-del_e) / (T) )
+        a = random.random()
+
+        if (pr > a):
+            return [*arr[:i], *arr[j+1:k+1], *arr[i:j+1], *arr[k+1:]]
+
+        else: return (arr)
+
+    else: return(arr)
+
+
+def segmentNeighbor(arr):
+    #Moves for asymmetric instances, reversing a segment would change the cost of
+    #every edge inside it
+    size = len(arr)
+
+    if random.random() > 0.5:
+        #Or-opt, move up to three cities to after position p
+        a = random.randint(1, size-2)
+        b = min(a + random.randint(0, 2), size-2)
+        p = random.randint(0, size-2)
+
+        if p > b:
+            return (exchange(arr, a, b, p))
+        elif p < a-1:
+            return (exchange(arr, p+1, a-1, b))
+        else: return (arr)
+
+    else:
+        #3-opt segment exchange
+        i, j, k = sorted(random.sample(range(1, size-1), 3))
+        return (exchange(arr, i, j, k))
+
+
 def testNeighbor(arr):
     r = random.random()
     size = len(arr)
 
-    a = random.randint(1,size-4)
-    b = random.randint(a+1, size-2)
+    if not distanceMatrix.symmetric:
+        return (segmentNeighbor(arr))
+
+    segment = None
+    if candidates is not None:
+        segment = neighbours.candidateSegment(arr, candidates)
+
+    if segment is not None:
+        a, b = segment
+    else:
+        a = random.randint(1,size-4)
+        b = random.randint(a+1, size-2)
 
     newarr = []
 
@@ -407,16 +382,17 @@ def SA(arr):
 
 
 def initializeAlgorithm():
-    global data, data_type_flag, set_debug, data_cordinate, data_fname, T
+    global data, set_debug, data_settings, scale_factor, T, local_polish
 
     #Controller Variables
     data = CONFIG['DATASET']['FILE_NAME']
-    data_type_flag = CONFIG.getint('DATASET', 'DATASET_TYPE')
     set_debug = CONFIG.getboolean('DEBUG', 'LOG_FILE')
-    data_cordinate = CONFIG.getboolean('DATASET','CONTAINS_COORDINATES')
+    data_settings = loader.Settings(CONFIG)
+    if distance.isInteger(data_settings.dtype):
+        scale_factor = 1     #TSPLIB rounding works on unscaled distances
     T =  CONFIG.getfloat('SIMULATED ANNEALING','TEMPERATURE')
+    local_polish = CONFIG.getboolean('LOCAL SEARCH', 'POLISH', fallback=False)
 
-    data_fname = "./dataset/" + data + ".txt"
 
 
 def outputRecord():
@@ -449,11 +425,7 @@ if __name__ == '__main__':
     logging_setup()
 
 
-    if data_type_flag == 0:
-        addCity_using_coords()
-
-    else:
-        addCity_using_dist()
+    loadDataset()
 
 
     route = list(range(numberOfCities))
@@ -468,7 +440,13 @@ if __name__ == '__main__':
 
 
     minDist,bestRoute = SA(route)
-    
+
+    if local_polish:
+        #2-opt over the candidate edges to finish off the best tour
+        bestRoute, gain = localsearch.twoOpt(bestRoute, distanceMatrix, candidates)
+        minDist = distanceMatrix.tour(bestRoute)
+        logger.info("LOCAL SEARCH: 2-opt saved {}".format(gain / scale_factor))
+
 
     #logger.info("FITNESS CURVE:\n{}".format(fitness_curve))  
     logger.info("MINIMAL DISTANCE={}".format(minDist / scale_factor))
@@ -19,6 +19,9 @@ import sys
 from time import time
 import eel
 
+import distance
+import loader
+
 CONFIG = configparser.ConfigParser()
 CONFIG.read('controller.ini')
 
@@ -26,7 +29,6 @@ CONFIG.read('controller.ini')
 numberOfCities = 0
 alpha_temp = 0.9
 
-loc_multiplier = math.pi / 180
 
 #Result Store
 
@@ -56,7 +58,7 @@ def addCity_using_coords(arr):
 
     for city in arr:
             i, x, y = city
-            cityCoord.append([float(x)*scale_factor,float(y)*scale_factor])  #Convert to float for accuracy
+            cityCoord.append([float(x),float(y)])  #Convert to float for accuracy
            
 
     numberOfCities =  len(cityCoord)
@@ -64,9 +66,8 @@ def addCity_using_coords(arr):
  
 
     if numberOfCities > 0:
-        distanceMatrix = []
         logger.info("Successfully added {cit} cities from data.".format(cit = numberOfCities))
-        generateDistMatrix()
+        generateDistMatrix(loader.fromCoords(cityCoord))
 
     if(numberOfCities != len(arr)):
         logger.warning("Dataset could not be loaded")
@@ -83,67 +84,26 @@ def addCity_using_dist():
 
     s_t = time()
 
-    
-    with open(str(data_fname), "r") as f:
-        distanceMatrix = []
-        dist_row = []
-
-        for line in f:
-            for val in line.split():
-                dist_row.append(float(val)*scale_factor)
-
-                
-            distanceMatrix.append (dist_row)
-            dist_row = []
-
-    numberOfCities = len(distanceMatrix[0])
+    try:
+        instance = loader.read(data_settings)
+    except (OSError, ValueError) as err:
+        logger.warning("Dataset could not be loaded: {}".format(err))
+        sys.exit()
+    numberOfCities = instance.dimension
  
 
     logger.info("Successfully added {cit} cities from data.".format(cit = numberOfCities))
-    e_t = time()
-    logger.info("CPU took {} to complete data loading and distance matrix building".format(e_t-s_t))
+    generateDistMatrix(instance)
 
 
-def generateDistMatrix():
+def generateDistMatrix(instance):
 
     global distanceMatrix, s_t, e_t
-    global numberOfCities
-
-
-    def deg2rad(deg):
-        return deg * loc_multiplier
 
-    for i in range(numberOfCities):
-        temp_dist = []
-        for j in range(i):  #Generating entire matrix. Can be optimized by generating upward triangle matrix
-            a = cityCoord[i]
-            b = cityCoord[j]
-            #Find Euclidean distance between points
+    distanceMatrix = loader.distances(instance, data_settings, scale_factor, logger)
 
-            #distance = np.linalg.norm(a-b)
-            if (data_cordinate == True):
-                distance = math.sqrt(math.pow(b[0]-a[0], 2) + math.pow(b[1] - a[1], 2 ))
-                temp_dist.append(float(distance))   #Using python list comprehension for better performance
-
-            else:
-                R = 6371 #Radius of the earth in km
-                lat1 = a[0]
-                lat2 = b[0]
-                long1 = a[1]
-                long2 = b[1]
-                dLat = deg2rad(lat2-lat1)
-                dLon = deg2rad(long2-long1)
-                a = math.sin(dLat/2) * math.sin(dLat/2) + math.cos(deg2rad(lat1)) * math.cos(deg2rad(lat2)) * math.sin(dLon/2) * math.sin(dLon/2)
-                c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-                distance = R * c
-                temp_dist.append(float(distance))
-
-        
-        distanceMatrix.append (temp_dist)
-    
     e_t = time()
     logger.info("CPU took {} to complete data loading and distance matrix building".format(e_t-s_t))
-    #print(distanceMatrix)
 
 
 #Data Logging
@@ -165,16 +125,7 @@ def logging_setup():
 
 
 def calculateSolutionFitness(arr):
-    distance = 0
-    
-    for j in range(len(arr)-1):
-        if(arr[j] < arr[j+1]):
-            distance += distanceMatrix[arr[j+1]][arr[j]]
-
-        else:
-            distance += distanceMatrix[arr[j]][arr[j+1]]
-
-    return (distance)
+    return (distanceMatrix.tour(arr))
 
 
 def reverse(arr, a, b):
@@ -309,17 +260,16 @@ def SA(arr):
 
 
 def initializeAlgorithm():
-    global data, data_type_flag, set_debug, data_cordinate, data_fname, T
+    global data, set_debug, data_settings, scale_factor, T
 
     #Controller Variables
     data = CONFIG['DATASET']['FILE_NAME']
-    data_type_flag = CONFIG.getint('DATASET', 'DATASET_TYPE')
     set_debug = CONFIG.getboolean('DEBUG', 'LOG_FILE')
-    data_cordinate = CONFIG.getboolean('DATASET','CONTAINS_COORDINATES')
+    data_settings = loader.Settings(CONFIG)
+    if distance.isInteger(data_settings.dtype):
+        scale_factor = 1     #TSPLIB rounding works on unscaled distances
     T =  CONFIG.getfloat('SIMULATED ANNEALING','TEMPERATURE')
 
-    data_fname = "./dataset/" + data + ".txt"
-
 
 @eel.expose 
 def runAlgo(temp):
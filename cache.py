@@ -0,0 +1,163 @@
+#Module to keep built distance matrices on disk between runs and tour lengths in
+#memory during a run
+import hashlib
+import os
+from collections import OrderedDict
+from time import time
+
+import numpy as np
+
+
+def datasetHash(fname, chunk=1 << 20):
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class MatrixCache:
+    #Matrices are stored as .npy files named after the dataset content and every
+    #setting that changes the values. The directory is trimmed by age first and then
+    #by size, least recently used files go first
+
+    def __init__(self, directory, maxBytes, maxAge):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+
+    def path(self, fname, settings):
+        #settings holds everything besides the file that the values depend on,
+        #e.g. (layout, metric, scale_factor, dtype)
+        key = "|".join([datasetHash(fname)] + [str(s) for s in settings])
+        digest = hashlib.sha1(key.encode()).hexdigest()[:20]
+        name = os.path.splitext(os.path.basename(fname))[0]
+        return os.path.join(self.directory, "{}_{}.npy".format(name, digest))
+
+    def load(self, fname, settings, shape, dtype, fill):
+        #Returns the matrix memory mapped from the cache and whether it was already there.
+        #On a miss fill(out) writes the values straight into the new cache file
+        path = self.path(fname, settings)
+
+        if os.path.exists(path):
+            try:
+                matrix = np.load(path, mmap_mode='r')
+                os.utime(path)      #Mark as recently used
+                return matrix, True
+            except (OSError, ValueError):
+                os.unlink(path)     #Truncated or corrupt entry, rebuild it
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=shape)
+        try:
+            fill(out)
+            out.flush()
+        except BaseException:
+            del out
+            os.unlink(tmp)
+            raise
+        del out
+        os.replace(tmp, path)
+
+        self.evict(keep=path)
+        return np.load(path, mmap_mode='r'), False
+
+    def evict(self, keep=None):
+        now = time()
+        entries = []
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            p = os.path.join(self.directory, name)
+            st = os.stat(p)
+
+            if p != keep and now - st.st_mtime > self.maxAge:
+                os.unlink(p)
+            else:
+                entries.append((st.st_mtime, st.st_size, p))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            if p == keep:
+                continue
+            os.unlink(p)
+            total -= size
+
+
+def canonicalTours(routes, symmetric=True):
+    #Rotate every closed route of a 2-D array to start at its smallest city and, when
+    #direction does not matter, orient it so the smaller neighbour comes second
+    cycle = np.asarray(routes)[:, :-1]
+    n = cycle.shape[1]
+    start = cycle.argmin(axis=1)
+    rot = np.take_along_axis(cycle, (start[:, None] + np.arange(n)) % n, axis=1)
+    if symmetric and n > 2:
+        flip = rot[:, 1] > rot[:, -1]
+        rot[flip, 1:] = rot[flip, :0:-1]
+    return rot.astype(np.int32, copy=False)
+
+
+class TourCache:
+    #Bounded LRU of tour lengths keyed by a digest of the canonical tour, so rotated,
+    #reversed and repeated copies of a route are only evaluated once
+
+    def __init__(self, maxEntries, symmetric=True):
+        self.maxEntries = maxEntries
+        self.symmetric = symmetric
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, routes):
+        return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in canonicalTours(routes, self.symmetric)]
+
+    def lengths(self, routes, evaluate):
+        #Lengths of every row of routes, evaluate(rows) is only called for the misses
+        routes = np.asarray(routes)
+        keys = self.keys(routes)
+        found = [None] * len(keys)
+        missing = OrderedDict()
+
+        for k, key in enumerate(keys):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                found[k] = self.entries[key]
+                self.hits += 1
+            elif key in missing:
+                missing[key].append(k)      #Duplicate inside this batch
+                self.hits += 1
+            else:
+                missing[key] = [k]
+                self.misses += 1
+
+        if missing:
+            rows = [same[0] for same in missing.values()]
+            for key, length in zip(missing, evaluate(routes[rows])):
+                self.entries[key] = length
+                for k in missing[key]:
+                    found[k] = length
+
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+        return np.array(found)
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return "{} hits, {} misses ({:.1f}% hit rate), {} tours stored".format(self.hits, self.misses, rate, len(self.entries))
+
+
+def fromConfig(config):
+    #Returns None when caching is switched off
+    if not config.getboolean('DISTANCE', 'CACHE', fallback=False):
+        return None
+
+    return MatrixCache(
+        config.get('DISTANCE', 'CACHE_DIR', fallback='./cache'),
+        config.getfloat('DISTANCE', 'CACHE_MAX_MB', fallback=4096) * (1 << 20),
+        config.getfloat('DISTANCE', 'CACHE_MAX_AGE_DAYS', fallback=30) * 86400)
@@ -0,0 +1,63 @@
+"""
+This script converts datasets to the binary instance format so the solvers can
+memory map them instead of parsing text on every run.
+
+Args:
+    names : Dataset names inside ./dataset (without .txt) or paths to files.
+            Use 'all' to convert every text dataset.
+    -e    : Treat headerless files as explicit distance matrices
+    -c    : Treat headerless files as "id x y" coordinates
+            Without either flag the layout is guessed from the first line.
+
+    example : python convert.py rl5915 att48
+              python convert.py all
+
+"""
+
+import argparse
+import os
+import sys
+from time import time
+
+import tsplib
+
+
+def datasetPath(name):
+    if os.path.exists(name):
+        return name
+    return "./dataset/" + name + ".txt"
+
+
+def convert(fname, explicit):
+    s_t = time()
+    instance = tsplib.read(fname, explicit=explicit)
+    target = tsplib.binaryName(fname)
+    tsplib.writeBinary(instance, target)
+
+    kind = "matrix" if instance.explicit else "coordinates"
+    print("{} -> {} ({} cities, {}, {:.3f}s)".format(fname, target, instance.dimension, kind, time() - s_t))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Convert datasets to the binary instance format")
+    parser.add_argument("names", nargs="+")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-e", "--explicit", dest="explicit", action="store_const", const=True)
+    group.add_argument("-c", "--coords", dest="explicit", action="store_const", const=False)
+    args = parser.parse_args()
+
+    names = args.names
+    if names == ["all"]:
+        names = sorted("./dataset/" + f for f in os.listdir("./dataset/") if f.endswith(".txt"))
+
+    failed = False
+    for name in names:
+        try:
+            convert(datasetPath(name), args.explicit)
+        except (OSError, ValueError) as err:
+            print("Could not convert {}: {}".format(name, err))
+            failed = True
+
+    if failed:
+        sys.exit(1)
@@ -1,175 +1,449 @@
 import random
+from itertools import chain
 import numpy as np
 
-def OC_Single(parentA, parentB):
+import kernels
+import neighbours
+import operators
+
+
+#Operators take an optional report list. For each child they append (source, spans)
+#when the closed child only differs from parents[source] at positions inside the
+#(lo, hi) spans, or None when the child has to be evaluated in full
+
+
+def closeTour(route, depot=0):
+    #OC_Single and OC_Multi return an open permutation that may start anywhere.
+    #Rotate it to start at the depot and close it so every offspring is n+1 long
+    route = list(route)
+    if len(route) > 1 and route[0] == depot and route[-1] == depot:
+        return route
+    i = route.index(depot)
+    return route[i:] + route[:i] + [depot]
+
+
+def fillMissing(child, genes, placed=None):
+    #Append the genes not in child yet, in the order they appear in genes.
+    #placed is a bytearray mask indexed by gene, built from child when not given
+    if placed is None:
+        placed = bytearray(max(max(genes), max(child, default=0)) + 1)
+        for gene in child:
+            placed[gene] = 1
+
+    for gene in genes:
+        if not placed[gene]:
+            placed[gene] = 1
+            child.append(int(gene))
+
+    return child
+
+
+def ocMultiChild(segmentParent, fillParent, a, b):
+    #segmentParent[a..b] stays in place. The other genes are taken from fillParent
+    #reading circularly from b+1; the first ones fill the child after the segment up to
+    #the end of the tour, the rest wrap around in front of it
+    n = len(fillParent)
+
+    segment = list(segmentParent[a:b+1])
+    placed = bytearray(max(fillParent) + 1)
+    for gene in segment:
+        placed[gene] = 1
+
+    order = []
+    for p in range(b+1, b+1+n):
+        gene = fillParent[p % n]
+        if not placed[gene]:
+            placed[gene] = 1
+            order.append(gene)
+
+    tail = n-1-b
+    return order[tail:] + segment + order[:tail]
+
+
+@operators.crossover()
+def OC_Single(parentA, parentB, report=None):
     geneCount = len(parentA) 
 
     r = random.randint(1, geneCount-2)
-    childA = [] 
-    childB = []
 
-    childA = list(parentB[:r])
-    childB = list(parentA[:r])
+    if kernels.active:
+        childA, childB = kernels.ocSingle(np.asarray(parentA), np.asarray(parentB), r)
+        childA, childB = childA.tolist(), childB.tolist()
+        if report is not None:
+            report.append((1, [(r, geneCount-2)]))
+            report.append((0, [(r, geneCount-2)]))
+        return childA, childB
 
-    for gene in parentA:
-        if gene in childA:
-            continue
-        else:
-            childA.append(int(gene))
-
-    for gene in parentB:
-        if gene in childB:
-            continue
-        else:
-            childB.append(int(gene))
+    #A mask of the genes already placed keeps the fill linear instead of scanning the child
+    childA = fillMissing(list(parentB[:r]), parentA)
+    childB = fillMissing(list(parentA[:r]), parentB)
 
+    #Each child keeps the other parent's prefix, its tail is reordered
+    if report is not None:
+        report.append((1, [(r, geneCount-2)]))
+        report.append((0, [(r, geneCount-2)]))
 
     return childA, childB
 
 
-def cycleCrossover(parentA, parentB):
-    geneCount = len(parentA)
+@operators.crossover()
+def cycleCrossover(parentA, parentB, report=None):
+    #Positions split into cycles: following a position to the gene parentB holds there
+    #and then to that gene's position in parentA always returns to the start. Children
+    #take whole cycles from alternating parents. The depot is a cycle of its own and
+    #stays at both ends, the rest is traced once through an inverse-position list
+    childA = parentA.tolist() if isinstance(parentA, np.ndarray) else list(parentA)
+    childB = parentB.tolist() if isinstance(parentB, np.ndarray) else list(parentB)
+    geneCount = len(childA)
 
-    childA = [0]
-    childB = [0]
+    pos = [0] * (max(childA) + 1)
+    for i in range(geneCount-1):
+        pos[childA[i]] = i
 
-    childA.append(parentB[1])
-    a = 1
-    while parentA[1] not in childB:
-        a = np.where(parentA == parentB[a])
-        a = np.where(parentA == parentB[a])
-        
-        
-        childB.append(int(parentB[a]))
+    visited = bytearray(geneCount)
+    swapped = []
+    swap = False
 
-        a = np.where(parentA == parentB[a])
+    for start in range(1, geneCount-1):
+        if visited[start]:
+            continue
+        p = start
+        while not visited[p]:
+            visited[p] = 1
+            if swap:
+                swapped.append((p, p))
+            p = pos[parentB[p]]
+        swap = not swap
+
+    for p, _ in swapped:
+        childA[p], childB[p] = childB[p], childA[p]
+
+    #Each child is its own parent outside the cycles taken from the other one
+    if report is not None:
+        report.append((0, swapped))
+        report.append((1, swapped))
 
-        if parentB[a] not in childA:
-            childA.append(int(parentB[a]))
+    return childA, childB
 
-    if len(childA) != geneCount:
-        for gene in np.nditer(parentA, flags=["refs_ok"]):
-            if gene in childA:
-                continue
-            else:
-                childA.append(int(gene))
-    
-    if len(childB) != geneCount:
-        for gene in np.nditer(parentB, flags=["refs_ok"]):
-            if gene in childB:
-                continue
-            else:
-                childB.append(int(gene))
 
-    return childA, childB
+def pmxChild(own, other, a, b):
+    #own with other[a..b] swapped in. where[g] is the position of gene g inside that
+    #segment (-1 outside it), a gene of own that would repeat is followed through the
+    #mapping with plain lookups until it no longer clashes.
+    #Returns the child and the (p, p) spans of the repaired positions
+    where = [-1] * (max(own) + 1)
+    for i in range(a, b+1):
+        where[other[i]] = i
 
+    child = list(own)
+    child[a:b+1] = other[a:b+1]
+    repaired = []
+
+    for p in chain(range(b+1, len(own)), range(a)):
+        gene = own[p]
+        if where[gene] < 0:
+            continue
+        while where[gene] >= 0:
+            gene = own[where[gene]]
+        child[p] = gene
+        repaired.append((p, p))
+
+    return child, repaired
 
-def PMS(parentA, parentB):
-    geneCount = len(parentA)
 
-    childA = []
-    childB = []
+@operators.crossover()
+def PMS(parentA, parentB, report=None):
+    geneCount = len(parentA)
 
     a = random.randint(1,geneCount-4)
     b = random.randint(a+1, geneCount-2)
+
+    if kernels.active:
+        arrA = np.asarray(parentA)
+        arrB = np.asarray(parentB)
+        childA, childB = kernels.pmx(arrA, arrB, a, b)
+        if report is not None:
+            #A mapped gene always differs from the one it replaced
+            report.append((0, [(a, b)] + [(p, p) for p in np.flatnonzero(childA != arrA) if not a <= p <= b]))
+            report.append((1, [(a, b)] + [(p, p) for p in np.flatnonzero(childB != arrB) if not a <= p <= b]))
+        return (childA.tolist(), childB.tolist())
       
-    childA[a:b+1] = parentB[a:b+1]
-    childB[a:b+1] = parentA[a:b+1]
-    
-    mapping_a = list(parentB[a:b+1])
-    mapping_b = list(parentA[a:b+1])
-    
-    def inList(val, arrFrom, arrTo):
-
-        res = arrTo[arrFrom.index(val)]
-
-        if(res in arrFrom):
-            return (inList(res, arrFrom, arrTo))
-        else: 
-            return res
-    
-    p = b + 1
-
-    for i in range(len(parentA)-len(mapping_a)):
-        if(p >= len(parentA)): p = 0
-
-        if (p > b):
-            if(parentA[p] in mapping_a):
-                childA.append(inList(parentA[p], mapping_a, mapping_b))
-            else:
-                childA.append(parentA[p]) 
-
-            if(parentB[p] in mapping_b):
-                childB.append(inList(parentB[p], mapping_b, mapping_a))
-            else:
-                childB.append (parentB[p])
-    
-        if(p < a):
-            if(parentA[p] in mapping_a):
-                childA.insert(p, inList(parentA[p], mapping_a, mapping_b) )
-            else:
-                childA.insert(p, parentA[p]) 
-
-            if(parentB[p] in mapping_b):
-                childB.insert(p, inList(parentB[p], mapping_b, mapping_a) )
-            else:
-                childB.insert(p, parentB[p])
-
-        
-        p +=1
+    childA, repairedA = pmxChild(parentA, parentB, a, b)
+    childB, repairedB = pmxChild(parentB, parentA, a, b)
+
+    #Outside the swapped segment a child only differs from its own parent where a
+    #duplicate was mapped away
+    if report is not None:
+        report.append((0, [(a, b)] + repairedA))
+        report.append((1, [(a, b)] + repairedB))
 
     return (childA, childB)
 
 
-def OC_Multi(parentA, parentB):
+@operators.crossover()
+def OC_Multi(parentA, parentB, report=None):
     geneCount = len(parentA)
 
-    childA = []
-    childB = []
-
     a = random.randint(1,geneCount-4)
     b = random.randint(a+1, geneCount-2)
 
-    childA = list(parentA[a:b+1])
-    childB = list(parentB[a:b+1])
-
-
-    p = b  #pointer to track parent index
-    c = p+1    #pointer to track child index
-    d = p+1   #pointer to track child index
-
-    for i in range(len(parentA)):
-        p +=1
-        
-        if (p >= len(parentA)-1):p = -1
-        if (c > len(parentA)-1): c = 0
-        if (d > len(parentA)-1): d = 0
-
-        if (c > b):
-            if(parentB[p] not in childA):
-                childA.append(parentB[p])
-                c +=1
-        
-
-        if (d > b):
-            if(parentA[p] not in childB):
-                childB.append(parentA[p])
-                d +=1
-                
-
-        if (c < a):
-            if(parentB[p] not in childA):
-                childA.insert(c, parentB[p])
-                c +=1
-        
-        if (d < a):
-            if(parentA[p] not in childB):
-                childB.insert(d, parentA[p])
-                d +=1
-    
-            
+    childA = ocMultiChild(parentA, parentB, a, b)
+    childB = ocMultiChild(parentB, parentA, a, b)
+
+    #Children come out rotated, nothing lines up with a parent
+    if report is not None:
+        report.extend([None, None])
 
     return(childA, childB)
 
 
+def tourLinks(route):
+    #links[c] holds the two neighbours of city c on the closed route
+    links = [[] for _ in range(max(route) + 1)]
+    for i in range(len(route)-1):
+        x, y = route[i], route[i+1]
+        links[x].append(y)
+        links[y].append(x)
+    return links
+
+
+def abCycles(parentA, parentB):
+    #AB-cycles: closed walks over the union of both tours that alternate between edges
+    #only parentA has and edges only parentB has. Each cycle is a list of cities, edge k
+    #runs from cycle[k] to cycle[k+1] (wrapping) and belongs to parentA for even k
+    adjA = tourLinks(parentA)
+    adjB = tourLinks(parentB)
+
+    for i in range(len(parentA)-1):
+        x, y = parentA[i], parentA[i+1]
+        if y in adjB[x]:
+            #Shared edges are in every offspring anyway
+            adjA[x].remove(y); adjA[y].remove(x)
+            adjB[x].remove(y); adjB[y].remove(x)
+
+    starts = [c for c in range(len(adjA)) if adjA[c]]
+    random.shuffle(starts)
+    cycles = []
+
+    for v in starts:
+        while adjA[v]:
+            path = [v]
+            seen = {v: [0]}
+
+            while len(path) > 1 or adjA[v]:
+                u = path[-1]
+                k = len(path) - 1
+                adj = adjA if k % 2 == 0 else adjB
+                w = adj[u].pop(random.randrange(len(adj[u])))
+                adj[w].remove(u)
+                path.append(w)
+                k += 1
+
+                #Back at a city an even number of edges ago closes an alternating cycle
+                hit = None
+                for j in seen.get(w, ()):
+                    if (k - j) % 2 == 0:
+                        hit = j
+                if hit is None:
+                    seen.setdefault(w, []).append(k)
+                    continue
+
+                cycle = path[hit:-1]
+                if hit % 2:
+                    cycle = cycle[1:] + cycle[:1]
+                cycles.append(cycle)
+
+                for j in range(hit+1, k):
+                    seen[path[j]].remove(j)
+                del path[hit+1:]
+
+    return cycles
+
+
+def mergeSubtours(links, dist, candidates):
+    #Join the subtours left in links into one tour. The smallest subtour is joined to
+    #another by exchanging one edge of each for the cheapest 2-opt style reconnection,
+    #looking at the candidate neighbours of its cities first. Returns the added length
+    d = dist.d
+    label = [-1] * len(links)
+    subtours = {}
+
+    for start in range(len(links)):
+        if label[start] >= 0 or not links[start]:
+            continue
+        cities = []
+        prev, c = None, start
+        while label[c] < 0:
+            label[c] = start
+            cities.append(c)
+            prev, c = c, links[c][0] if links[c][0] != prev else links[c][1]
+        subtours[start] = cities
+
+    added = 0
+    while len(subtours) > 1:
+        own = min(subtours, key=lambda t: len(subtours[t]))
+        best = None
+
+        for pool in ((lambda c: candidates[c]) if candidates is not None else None, lambda c: range(len(links))):
+            if pool is None:
+                continue
+            for c in subtours[own]:
+                for c2 in links[c]:
+                    for v in pool(c):
+                        if label[v] == own or not links[v]:
+                            continue
+                        for v2 in links[v]:
+                            base = d(c, c2) + d(v, v2)
+                            for x, y in ((v, v2), (v2, v)):
+                                gain = d(c, x) + d(c2, y) - base
+                                if best is None or gain < best[0]:
+                                    best = (gain, c, c2, v, v2, x, y)
+            if best is not None:
+                break
+
+        gain, c, c2, v, v2, x, y = best
+        links[c].remove(c2); links[c2].remove(c)
+        links[v].remove(v2); links[v2].remove(v)
+        links[c].append(x); links[x].append(c)
+        links[c2].append(y); links[y].append(c2)
+        added += gain
+
+        other = label[v]
+        for city in subtours[own]:
+            label[city] = other
+        subtours[other].extend(subtours.pop(own))
+
+    return added
+
+
+def eaxChild(parentA, parentB, dist, candidates, tries):
+    #Offspring of parentA: the A edges of one AB-cycle are replaced by its B edges and
+    #the resulting subtours merged. Up to tries cycles are applied and the shortest
+    #child is kept
+    cycles = abCycles(parentA, parentB)
+    if not cycles:
+        return list(parentA)
+
+    d = dist.d
+    base = tourLinks(parentA)
+    best = None
+
+    for cycle in cycles[:tries]:
+        links = [pair[:] for pair in base]
+        m = len(cycle)
+        gain = 0
+        for k in range(0, m, 2):
+            x, y = cycle[k], cycle[(k+1) % m]
+            links[x].remove(y); links[y].remove(x)
+            gain -= d(x, y)
+        for k in range(1, m, 2):
+            x, y = cycle[k], cycle[(k+1) % m]
+            links[x].append(y); links[y].append(x)
+            gain += d(x, y)
+
+        gain += mergeSubtours(links, dist, candidates)
+        if best is None or gain < best[0]:
+            best = (gain, links)
+
+    links = best[1]
+    depot = parentA[0]
+    child = [depot]
+    prev, c = depot, links[depot][0]
+    while c != depot:
+        child.append(c)
+        prev, c = c, links[c][0] if links[c][0] != prev else links[c][1]
+    child.append(depot)
+
+    return child
+
+
+@operators.crossover(context=True)
+def EAX(parentA, parentB, report=None, dist=None, candidates=None, tries=10):
+    #Edge Assembly Crossover: children are built from the edges of both parents. The
+    #parents' differing edges split into AB-cycles, each child swaps one of them into
+    #its parent and reconnects the subtours this creates with short new edges.
+    #Edges are treated as undirected, needs the distance object for the reconnection
+    if dist is None:
+        raise ValueError("EAX needs the distance matrix")
+
+    parentA = parentA.tolist() if isinstance(parentA, np.ndarray) else list(parentA)
+    parentB = parentB.tolist() if isinstance(parentB, np.ndarray) else list(parentB)
+
+    childA = eaxChild(parentA, parentB, dist, candidates, tries)
+    childB = eaxChild(parentB, parentA, dist, candidates, tries)
+
+    #Edges move around the whole tour, the lengths are evaluated in full
+    if report is not None:
+        report.extend([None, None])
+
+    return childA, childB
 
+#Whole generation variants. They take (k, n+1) arrays of closed parent tours and
+#per-pair cut points (drawn the same way as the single pair operators when not given)
+#and return closed (k, n+1) children, pair i giving the same two children as the
+#single pair operator would for the same cuts
+
+
+@operators.batched("OC_Single")
+def batchOC_Single(parentsA, parentsB, r=None):
+    k, n = parentsA.shape
+    rows = np.arange(k)[:, None]
+
+    if r is None:
+        r = np.random.randint(1, n-1, size=k)
+    r = np.asarray(r)[:, None]
+
+    def children(prefix, fill):
+        #prefix[:r] then the genes of fill outside that prefix, in fill's order
+        child = np.empty_like(fill)
+        head = np.arange(n) < r
+        child[head] = prefix[head]
+
+        keep = neighbours.positions(prefix)[rows, fill] >= r
+        keep[:, -1] = False             #Closing depot
+        dest = r + np.cumsum(keep, axis=1) - 1
+        child[np.broadcast_to(rows, keep.shape)[keep], dest[keep]] = fill[keep]
+
+        child[:, -1] = child[:, 0]
+        return child
+
+    return children(parentsB, parentsA), children(parentsA, parentsB)
+
+
+@operators.batched("PMS")
+def batchPMS(parentsA, parentsB, a=None, b=None):
+    k, n = parentsA.shape
+    rows = np.arange(k)[:, None]
+    cols = np.arange(n)
+
+    if a is None:
+        a = np.random.randint(1, n-3, size=k)
+        b = a + 1 + (np.random.random(k) * (n-2-a)).astype(np.intp)
+    a = np.asarray(a)[:, None]
+    b = np.asarray(b)[:, None]
+    segment = (cols >= a) & (cols <= b)
+
+    def children(own, other):
+        #own with other[a..b] swapped in, clashing genes outside the segment are
+        #followed through the mapping until they no longer clash, all pairs at once
+        where = np.full((k, own.max() + 1), -1, dtype=np.intp)
+        seg = np.broadcast_to(rows, segment.shape)[segment]
+        where[seg, other[segment]] = np.broadcast_to(cols, segment.shape)[segment]
+
+        child = np.where(segment, other, own)
+        idx = np.flatnonzero(~segment)
+        r, p = np.divmod(idx, n)
+        v = own[r, p]
+
+        while True:
+            hop = where[r, v]
+            clash = hop >= 0
+            if not clash.any():
+                break
+            r, idx = r[clash], idx[clash]
+            v = own[r, hop[clash]]
+            np.put(child, idx, v)
+
+        return child
+
+    return children(parentsA, parentsB), children(parentsB, parentsA)
@@ -0,0 +1,444 @@
+#Module to build distance matrices for the TSP solvers
+import atexit
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+R = 6371    #Radius of the earth in km
+loc_multiplier = np.pi / 180
+
+#Upper bound on the number of pair distances evaluated in one kernel call. Keeps the
+#temporaries of a row block around 32MB no matter how many cities are loaded
+BLOCK_ELEMENTS = 1 << 22
+
+
+def euclidean(a, b):
+    #a and b broadcast against each other, the last axis holds (x, y)
+    dx = a[..., 0] - b[..., 0]
+    dy = a[..., 1] - b[..., 1]
+    return np.sqrt(dx * dx + dy * dy)
+
+
+def haversine(a, b):
+    #Great circle distance, coordinates are (latitude, longitude) in degrees
+    lat1 = a[..., 0] * loc_multiplier
+    lat2 = b[..., 0] * loc_multiplier
+    dLat = lat2 - lat1
+    dLon = (b[..., 1] - a[..., 1]) * loc_multiplier
+
+    h = np.sin(dLat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dLon / 2) ** 2
+    h = np.clip(h, 0.0, 1.0)
+    return R * 2 * np.arctan2(np.sqrt(h), np.sqrt(1 - h))
+
+
+def att(a, b):
+    #TSPLIB pseudo-Euclidean distance
+    dx = a[..., 0] - b[..., 0]
+    dy = a[..., 1] - b[..., 1]
+    return np.sqrt((dx * dx + dy * dy) / 10.0)
+
+
+def geoRadians(v):
+    #TSPLIB GEO coordinates are DDD.MM, degrees and minutes
+    deg = np.trunc(v)
+    return 3.141592 * (deg + 5.0 * (v - deg) / 3.0) / 180.0
+
+
+def geo(a, b):
+    #TSPLIB idealised sphere distance in km, coordinates are (latitude, longitude)
+    lat1 = geoRadians(a[..., 0])
+    lat2 = geoRadians(b[..., 0])
+    q1 = np.cos(geoRadians(a[..., 1]) - geoRadians(b[..., 1]))
+    q2 = np.cos(lat1 - lat2)
+    q3 = np.cos(lat1 + lat2)
+    return 6378.388 * np.arccos(np.clip(0.5 * ((1.0 + q1) * q2 - (1.0 - q1) * q3), -1.0, 1.0))
+
+
+METRICS = {
+    "euclidean": euclidean,
+    "ceil2d": euclidean,
+    "haversine": haversine,
+    "att": att,
+    "geo": geo,
+}
+
+
+def nint(x):
+    return np.floor(x + 0.5)
+
+
+def attRound(x):
+    #TSPLIB rounds pseudo-Euclidean distances up whenever nint rounded down
+    t = nint(x)
+    return np.where(t < x, t + 1, t)
+
+
+#How each metric is rounded when distances are stored as integers, as in TSPLIB
+ROUNDING = {
+    "euclidean": nint,
+    "ceil2d": np.ceil,
+    "haversine": nint,
+    "att": attRound,
+    "geo": lambda x: np.trunc(x + 1.0),
+}
+
+
+def isInteger(dtype):
+    return np.dtype(dtype).kind in "iu"
+
+
+def kernelFor(metric, dtype=np.float64, scale=1.0):
+    #Kernel returning scaled distances, rounded the TSPLIB way for integer dtypes
+    if metric not in METRICS:
+        raise ValueError("Unknown distance metric: {}".format(metric))
+
+    kernel = METRICS[metric]
+    if isInteger(dtype):
+        rounding = ROUNDING[metric]
+        return lambda a, b: rounding(kernel(a, b) * scale)
+    if scale == 1.0:
+        return kernel
+    return lambda a, b: kernel(a, b) * scale
+
+
+def total(d, axis=None):
+    #Sum of distances, integer distances are summed exactly in 64 bits
+    if isInteger(d.dtype):
+        return d.sum(axis=axis, dtype=np.int64)
+    return d.sum(axis=axis)
+
+
+def blockRows(n):
+    return max(1, BLOCK_ELEMENTS // max(n, 1))
+
+
+def pairwise(kernel, a, b):
+    #Distance from every point in a to every point in b, shape (len(a), len(b))
+    return kernel(a[:, None, :], b[None, :, :])
+
+
+def matrixBytes(n, dtype):
+    #Memory a condensed matrix for n cities would take
+    return n * (n - 1) // 2 * np.dtype(dtype).itemsize
+
+
+#Shared memory segments used by this process, kept open until exit so arrays viewing
+#them stay valid. Segments created here are also unlinked at exit
+segments = {}
+owned = set()
+
+
+def sharedArray(length, dtype, name=None):
+    #Create a new segment when name is None, otherwise attach to an existing one
+    dtype = np.dtype(dtype)
+    if name is None:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, length * dtype.itemsize))
+        owned.add(shm.name)
+    elif name in segments:
+        shm = segments[name]
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+    segments[shm.name] = shm
+    return np.ndarray((length,), dtype=dtype, buffer=shm.buf), shm.name
+
+
+@atexit.register
+def releaseShared():
+    for name, shm in list(segments.items()):
+        try:
+            shm.close()
+        except BufferError:
+            pass        #Still viewed by a live array, the OS reclaims it at exit
+        if name in owned:
+            shm.unlink()
+    segments.clear()
+    owned.clear()
+
+
+def openDirected(name, n, dtype):
+    data, name = sharedArray(n * n, dtype, name=name)
+    return DirectedMatrix(data.reshape(n, n), shared=name)
+
+
+def openCondensed(source, length, dtype, offset=None):
+    #Rebuild a pickled CondensedMatrix without copying its values. source is a shared
+    #memory segment name, or a .npy file when offset is given
+    if offset is not None:
+        return CondensedMatrix(np.memmap(source, dtype=np.dtype(dtype), mode="r", offset=offset, shape=(length,)))
+    data, name = sharedArray(length, dtype, name=source)
+    return CondensedMatrix(data, shared=name)
+
+
+class CondensedMatrix:
+    #Symmetric matrix stored as its strict lower triangle in one contiguous array.
+    #Entry (i, j) with i > j lives at i*(i-1)/2 + j, the diagonal is implicitly zero
+    symmetric = True
+
+    def __init__(self, data, shared=None):
+        self.data = data
+        self.shared = shared        #Name of the shared memory segment holding data
+        self.n = int(round((1 + np.sqrt(1 + 8 * len(data))) / 2))
+
+    def __reduce__(self):
+        #Child processes attach to the same memory instead of receiving a copy
+        if self.shared is not None:
+            return (openCondensed, (self.shared, len(self.data), self.data.dtype.str))
+        if isinstance(self.data, np.memmap) and self.data.filename:
+            return (openCondensed, (self.data.filename, len(self.data), self.data.dtype.str, self.data.offset))
+        return (CondensedMatrix, (np.asarray(self.data),))
+
+    @classmethod
+    def fromSquare(cls, matrix, dtype=None, shared=False):
+        matrix = np.asarray(matrix)
+        n = len(matrix)
+        length = n * (n - 1) // 2
+        dtype = dtype or matrix.dtype
+        name = None
+        if shared:
+            data, name = sharedArray(length, dtype)
+        else:
+            data = np.empty(length, dtype=dtype)
+        for i in range(1, n):
+            off = i * (i - 1) // 2
+            data[off:off + i] = matrix[i, :i]
+        return cls(data, shared=name)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def d(self, i, j):
+        if i == j:
+            return self.data.dtype.type(0)
+        if i < j:
+            i, j = j, i
+        return self.data[i * (i - 1) // 2 + j]
+
+    def pairs(self, a, b):
+        #Distances for every pair (a[k], b[k])
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        hi = np.maximum(a, b)
+        lo = np.minimum(a, b)
+        idx = hi * (hi - 1) // 2 + lo
+        same = hi == lo
+        if same.any():
+            idx[same] = 0
+            return np.where(same, 0, self.data[idx])
+        return self.data[idx]
+
+    def tour(self, path):
+        path = np.asarray(path)
+        return total(self.pairs(path[:-1], path[1:]))
+
+    def tours(self, paths):
+        #Length of every row of a 2-D array of closed routes
+        paths = np.asarray(paths)
+        return total(self.pairs(paths[:, :-1], paths[:, 1:]), axis=1)
+
+
+def fillCondensed(data, coords, kernel, start, end, step):
+    #Write rows [start, end) of the lower triangle into data
+    for lo in range(start, end, step):
+        hi = min(lo + step, end)
+        block = pairwise(kernel, coords[lo:hi], coords[:hi - 1])
+        for i in range(lo, hi):
+            off = i * (i - 1) // 2
+            data[off:off + i] = block[i - lo, :i]
+
+
+def rowRanges(n, parts):
+    #Split rows 1..n into ranges holding roughly the same share of the triangle
+    bounds = np.unique(np.round(n * np.sqrt(np.linspace(0, 1, parts + 1))).astype(np.int64))
+    bounds = np.unique(np.clip(bounds, 1, n))
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+#State of a pool worker, set once by initWorker
+worker = {}
+
+
+def initWorker(target, length, dtype, coords, metric, scale, step):
+    #target is a shared memory name or a (filename, offset) pair of a .npy memmap
+    if isinstance(target, tuple):
+        data = np.memmap(target[0], dtype=np.dtype(dtype), mode="r+", offset=target[1], shape=(length,))
+    else:
+        data, _ = sharedArray(length, dtype, name=target)
+    worker.update(data=data, coords=coords, kernel=kernelFor(metric, dtype, scale), step=step)
+
+
+def fillWorker(rows):
+    fillCondensed(worker["data"], worker["coords"], worker["kernel"], rows[0], rows[1], worker["step"])
+    if isinstance(worker["data"], np.memmap):
+        worker["data"].flush()
+    return rows
+
+
+def buildCondensed(coords, metric="euclidean", dtype=np.float64, rows=None, scale=1.0, workers=1, shared=False, out=None):
+    #Lower triangle only, never holds more than one block of rows of the full matrix.
+    #With workers > 1 row blocks are computed by a process pool writing straight into
+    #shared memory, or into out when it is a writable .npy memmap. workers=0 uses every
+    #core, shared=True places the result in shared memory even for a serial build
+    kernel = kernelFor(metric, dtype, scale)
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    n = len(coords)
+    step = rows or blockRows(n)
+    length = n * (n - 1) // 2
+    workers = workers or multiprocessing.cpu_count()
+    name = None
+
+    if out is not None:
+        data = out
+    elif shared or workers > 1:
+        data, name = sharedArray(length, dtype)
+    else:
+        data = np.empty(length, dtype=dtype)
+
+    target = name
+    if isinstance(data, np.memmap) and data.filename:
+        target = (data.filename, data.offset)
+
+    if workers > 1 and n > step and target is not None:
+        with multiprocessing.Pool(workers, initializer=initWorker,
+                                  initargs=(target, length, np.dtype(dtype).str, coords, metric, scale, step)) as pool:
+            pool.map(fillWorker, rowRanges(n, workers * 4))
+    else:
+        fillCondensed(data, coords, kernel, 1, n, step)
+
+    return CondensedMatrix(data, shared=name)
+
+
+class DirectedMatrix:
+    #Full n x n matrix for asymmetric instances, d(i, j) is the cost of going from
+    #city i to city j and may differ from d(j, i)
+    symmetric = False
+
+    def __init__(self, data, shared=None):
+        self.data = data
+        self.shared = shared
+        self.n = len(data)
+
+    @classmethod
+    def fromSquare(cls, matrix, dtype=None, shared=False):
+        matrix = np.asarray(matrix)
+        n = len(matrix)
+        dtype = dtype or matrix.dtype
+        name = None
+        if shared:
+            data, name = sharedArray(n * n, dtype)
+            data = data.reshape(n, n)
+        else:
+            data = np.empty((n, n), dtype=dtype)
+        data[:] = matrix
+        np.fill_diagonal(data, 0)
+        return cls(data, shared=name)
+
+    def __reduce__(self):
+        if self.shared is not None:
+            return (openDirected, (self.shared, self.n, self.data.dtype.str))
+        return (DirectedMatrix, (np.asarray(self.data),))
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def d(self, i, j):
+        return self.data[i, j]
+
+    def pairs(self, a, b):
+        return self.data[np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64)]
+
+    def tour(self, path):
+        path = np.asarray(path)
+        return total(self.pairs(path[:-1], path[1:]))
+
+    def tours(self, paths):
+        #Length of every row of a 2-D array of closed routes
+        paths = np.asarray(paths)
+        return total(self.pairs(paths[:, :-1], paths[:, 1:]), axis=1)
+
+
+def fromWeights(weights, dtype=None, shared=False):
+    #Explicit matrices are packed into a triangle unless they are asymmetric
+    weights = np.asarray(weights)
+    if np.array_equal(weights, weights.T):
+        return CondensedMatrix.fromSquare(weights, dtype=dtype, shared=shared)
+    return DirectedMatrix.fromSquare(weights, dtype=dtype, shared=shared)
+
+
+def exchangeDelta(dist, route, i, j, k):
+    #Length change from swapping the adjacent blocks route[i..j] and route[j+1..k]
+    #(i <= j < k, 0 < i and k < len(route)-1). Neither block is reversed so the delta
+    #is exact for directed matrices too. Or-opt is the case of a short block
+    d = dist.d
+    a, b, c, e, f, g = route[i - 1], route[i], route[j], route[j + 1], route[k], route[k + 1]
+    return d(a, e) + d(f, b) + d(c, g) - d(a, b) - d(c, e) - d(f, g)
+
+
+def edgeSum(dist, route, edges):
+    #Total length of the edges route[e] -> route[e+1] for every position e in edges
+    if not edges:
+        return 0
+    return total(dist.pairs([route[e] for e in edges], [route[e + 1] for e in edges]))
+
+
+def spanEdges(spans):
+    #Positions of the edges touching any position inside the (lo, hi) spans
+    edges = set()
+    for lo, hi in spans:
+        edges.update(range(lo - 1, hi + 1))
+    return sorted(edges)
+
+
+def patchedLength(dist, old, oldLength, new, spans):
+    #Length of new when it only differs from old at positions inside spans. Costs
+    #O(changed edges) instead of O(n)
+    edges = spanEdges(spans)
+    return oldLength + edgeSum(dist, new, edges) - edgeSum(dist, old, edges)
+
+
+class CoordinateDistance:
+    #Matrix free drop in for CondensedMatrix. Every lookup is evaluated from the
+    #(n, 2) coordinate array so memory stays O(n) for very large instances
+    symmetric = True
+
+    def __init__(self, coords, metric="euclidean", dtype=np.float64, scale=1.0):
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)
+        self.n = len(self.coords)
+        self.metric = metric
+        self.kernel = kernelFor(metric, dtype, scale)
+        self.dtype = np.dtype(dtype)
+        self.scale = scale
+
+    def __reduce__(self):
+        return (CoordinateDistance, (self.coords, self.metric, self.dtype.str, self.scale))
+
+    @property
+    def nbytes(self):
+        return self.coords.nbytes
+
+    def d(self, i, j):
+        return self.dtype.type(self.kernel(self.coords[i], self.coords[j]))
+
+    def pairs(self, a, b):
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        return self.kernel(self.coords[a], self.coords[b]).astype(self.dtype, copy=False)
+
+    def tour(self, path):
+        path = np.asarray(path)
+        return total(self.pairs(path[:-1], path[1:]))
+
+    def tours(self, paths):
+        #Length of every row of a 2-D array of closed routes
+        paths = np.asarray(paths)
+        return total(self.pairs(paths[:, :-1], paths[:, 1:]), axis=1)
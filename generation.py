@@ -0,0 +1,226 @@
+#Module with the generation loop shared by the GA scripts
+#
+#A Population holds the routes of the current generation as a (pop, n+1) int32 array
+#with their tour lengths and normalised fitness. nextGeneration keeps the best route
+#twice, draws every parent of the generation at once, crosses the pairs (in one batched
+#call when the operator has a batch variant), mutates all crossover children in one batch
+#and evaluates only the lengths still unknown. improve, when given, is called right after
+#mutation with (routes, rows, lengths, shift): the population array, the rows of the
+#crossover children, their known lengths and the {row: change in length} of the mutation,
+#all three to be patched in place by whatever it changes
+import math
+import random
+
+import numpy as np
+
+import crossover
+import distance
+import selection
+
+SELECTIONS = ("roulette", "tournament", "rank", "SUS")
+
+CROSSOVER_PROBABILITY = 0.8
+
+
+class Population:
+
+    def __init__(self, routes, dist, crossoverOperator, mutationOperator, mutationRate, size=None,
+                 candidates=None, fitnessCache=None, sel="roulette", tournamentSize=3, rankPressure=1.5,
+                 batch=False, improve=None, scale=1, precision=4):
+        if sel not in SELECTIONS:
+            raise ValueError("Unknown selection operator: {}".format(sel))
+
+        self.dist = dist
+        self.candidates = candidates
+        self.fitnessCache = fitnessCache        #Memo of evaluated tour lengths, None when disabled
+        self.crossoverOperator = crossoverOperator
+        self.mutationOperator = mutationOperator
+        self.mutationRate = mutationRate
+        self.sel = sel
+        self.tournamentSize = tournamentSize
+        self.rankPressure = rankPressure
+        self.batch = batch
+        self.improve = improve
+        self.scale = scale
+        self.precision = precision              #Decimals kept in fitnessCurve
+
+        self.populationMatrix = np.array(routes, dtype=np.int32)
+        self.size = size or len(self.populationMatrix)      #Routes bred per generation
+        self.populationLengths = None           #Tour length of every row of populationMatrix
+        self.fitnessMatrix = None
+        self.totalFitness = 0
+
+        #Routes of the generation being built and their known lengths (None when unknown),
+        #anything left here is carried into the next generation
+        self.nextGenerationMatrix = []
+        self.nextGenerationLengths = []
+
+        self.minDist = math.inf
+        self.bestRoute = []
+        self.fitnessCurve = []
+
+    def matingPoolSelection(self, count):
+        #Draw count parents with the configured selection operator. The wheel (or
+        #tournament) is built once and all parents are returned together, as indices
+        if self.sel == "roulette":
+            return selection.roulette(self.fitnessMatrix, count)
+        elif self.sel == "tournament":
+            return selection.tournament(self.fitnessMatrix, count, self.tournamentSize)
+        elif self.sel == "rank":
+            return selection.rank(self.fitnessMatrix, count, self.rankPressure)
+        return selection.SUS(self.fitnessMatrix, count)
+
+    def evaluateTours(self, routes):
+        #Lengths of a 2-D array of routes, tours seen before are served from the cache
+        if self.fitnessCache is None:
+            return self.dist.tours(routes)
+        return self.fitnessCache.lengths(routes, self.dist.tours)
+
+    def calculateFitness(self, lengths=None):
+        #lengths holds the already known tour lengths of the population, None entries
+        #are evaluated here
+
+        #Tour length of every individual in one gather over the (pop, n+1) population array
+        if lengths is None:
+            lengths = self.evaluateTours(self.populationMatrix)
+        else:
+            unknown = [k for k, length in enumerate(lengths) if length is None]
+            if unknown:
+                for k, length in zip(unknown, self.evaluateTours(self.populationMatrix[unknown])):
+                    lengths[k] = length
+            lengths = np.array(lengths)
+
+            #Patched lengths carry rounding error, confirm possible new bests exactly so
+            #drift cannot fake an improvement
+            better = np.flatnonzero(lengths < self.minDist)
+            if len(better):
+                lengths[better] = self.dist.tours(self.populationMatrix[better])
+
+        self.populationLengths = lengths
+        best = lengths.argmin()
+
+        if lengths[best] < self.minDist:
+            self.minDist = lengths[best]
+            self.bestRoute = self.populationMatrix[best].tolist()
+
+        fitness = 1 / lengths       #For routes with smaller distance to have highest fitness
+        self.totalFitness = fitness.sum()
+        self.fitnessMatrix = fitness / self.totalFitness      #Normalizing the fitness values between [0-1]
+
+        self.fitnessCurve.append(round(self.minDist / self.scale, self.precision))
+
+    def mutateOffspring(self, rows, lengths):
+        #Mutates the crossover children of the generation (rows of populationMatrix) in one
+        #batch and patches their lengths where known. Returns {row: change in length}
+        rows = np.asarray(rows, dtype=np.intp)
+        offspring = self.populationMatrix[rows]
+
+        mutated, deltas = self.mutationOperator.mutateBatch(offspring, self.mutationRate, self.candidates, self.dist)
+        self.populationMatrix[rows] = offspring
+        self.mutationOperator.credit(-float(deltas.sum()), len(mutated))
+
+        shift = {}
+        for k, delta in zip(rows[mutated].tolist(), deltas.tolist()):
+            if lengths[k] is not None:
+                lengths[k] += delta
+            shift[k] = delta
+
+        return shift
+
+    def offspringLength(self, child, parents, lengths, entry):
+        #Length of a crossover child patched from the parent reported by the operator
+        if entry is None:
+            return None
+        source, spans = entry
+        return distance.patchedLength(self.dist, parents[source], lengths[source], child, spans)
+
+    def breedGeneration(self, parents):
+        #Whole generation crossover: the parent pairs are stacked into one (k, n+1) array and
+        #crossed with a single call of the batched operator. Returns the rows of the children
+        children = self.populationMatrix[parents]
+        lengths = self.populationLengths[parents].copy()
+        rows = np.zeros(0, dtype=np.intp)
+        offset = len(self.nextGenerationMatrix)
+
+        crossed = np.flatnonzero(np.random.random(len(parents) // 2) < CROSSOVER_PROBABILITY)
+        if len(crossed):
+            first, second = 2 * crossed, 2 * crossed + 1
+            reference = (lengths[first] + lengths[second]) / 2
+            children[first], children[second] = self.crossoverOperator.crossBatch(children[first], children[second])
+            rows = np.concatenate([first, second])
+            lengths[rows] = self.evaluateTours(children[rows])
+            self.crossoverOperator.credit(float((2 * reference - lengths[first] - lengths[second]).sum()), len(rows))
+
+        self.nextGenerationMatrix.extend(children)
+        self.nextGenerationLengths.extend(lengths.tolist())
+
+        return (offset + rows).tolist()
+
+    def nextGeneration(self):
+        nextGenerationMatrix = self.nextGenerationMatrix
+        nextGenerationLengths = self.nextGenerationLengths
+        operator = self.crossoverOperator
+
+        nextGenerationMatrix.append(self.bestRoute)      #Elitism, moving the fittest gene to the new generation as is
+        nextGenerationMatrix.append(self.bestRoute)
+        nextGenerationLengths.extend([self.minDist, self.minDist])
+
+        #Every pair adds two children, draw the parents of the whole generation up front
+        pairs = max(0, -(-(self.size - len(nextGenerationMatrix)) // 2))
+        parents = self.matingPoolSelection(2 * pairs)
+
+        offspring = []
+        if self.batch and operator.batch is not None:
+            #One crossover call for the whole generation, the loop below has nothing left to do
+            offspring = self.breedGeneration(parents)
+        parents = iter(parents)
+        pending = []
+
+        while len(nextGenerationMatrix) < self.size:
+
+            i = next(parents)
+            j = next(parents)
+            parentA = self.populationMatrix[i].tolist()
+            parentB = self.populationMatrix[j].tolist()
+            parentLengths = (self.populationLengths[i], self.populationLengths[j])
+
+            if random.random() < CROSSOVER_PROBABILITY:
+                report = []
+                childA, childB = operator(parentA, parentB, report, dist=self.dist, candidates=self.candidates)
+
+                childA = crossover.closeTour(childA)
+                childB = crossover.closeTour(childB)
+
+                lengthA = self.offspringLength(childA, (parentA, parentB), parentLengths, report[0])
+                lengthB = self.offspringLength(childB, (parentA, parentB), parentLengths, report[1])
+                reference = (parentLengths[0] + parentLengths[1]) / 2
+
+                #The crossover is credited with the lengths before mutation, children
+                #without a known length are settled once the generation is evaluated
+                for child, length in ((childA, lengthA), (childB, lengthB)):
+                    if length is None:
+                        pending.append((len(nextGenerationMatrix), reference))
+                    else:
+                        operator.credit(reference - length)
+                    offspring.append(len(nextGenerationMatrix))
+                    nextGenerationMatrix.append(child)
+                nextGenerationLengths.extend([lengthA, lengthB])
+            else:
+                #Unchanged copies keep their length
+                nextGenerationMatrix.append(parentA)
+                nextGenerationMatrix.append(parentB)
+                nextGenerationLengths.extend(parentLengths)
+
+        self.populationMatrix = np.array(nextGenerationMatrix, dtype=np.int32)
+        lengths = nextGenerationLengths.copy()
+        nextGenerationMatrix.clear()
+        nextGenerationLengths.clear()
+
+        #Only crossover children are mutated, all of them in one batch
+        shift = self.mutateOffspring(offspring, lengths)
+        if self.improve is not None:
+            self.improve(self.populationMatrix, offspring, lengths, shift)
+        self.calculateFitness(lengths)
+
+        for k, reference in pending:
+            operator.credit(reference - (self.populationLengths[k] - shift.get(k, 0)))
@@ -0,0 +1,83 @@
+#Module to load a dataset and build what the solvers need from it
+#
+#Every entry point reads its [DATASET] and [DISTANCE] options into a Settings once at
+#startup, gets the instance from read (or fromCoords for cities handed over by the UI)
+#and builds the distance object and candidate lists with distances and candidates.
+#Distances are measured on the raw coordinates and multiplied by scale, so GEO/haversine
+#inputs stay in degrees
+import numpy as np
+
+import cache
+import distance
+import neighbours
+import tsplib
+
+
+class Settings:
+
+    def __init__(self, config):
+        self.fname = "./dataset/" + config['DATASET']['FILE_NAME'] + ".txt"
+        self.explicit = config.getint('DATASET', 'DATASET_TYPE') != 0     #Only used for headerless files
+        self.coordinates = config.getboolean('DATASET', 'CONTAINS_COORDINATES')
+        self.dtype = config.get('DISTANCE', 'PRECISION', fallback='float64')
+        self.metric = config.get('DISTANCE', 'METRIC', fallback='') or None
+        self.cache = cache.fromConfig(config)
+        self.memLimit = config.getfloat('DISTANCE', 'MATRIX_MEMORY_LIMIT_MB', fallback=2048) * (1 << 20)
+        self.workers = config.getint('DISTANCE', 'WORKERS', fallback=1)
+        self.neighbours = config.getint('DISTANCE', 'NEIGHBOURS', fallback=8)
+
+
+def read(settings):
+    #The configured dataset, raises OSError or ValueError when it cannot be loaded
+    return tsplib.load(settings.fname, explicit=settings.explicit)
+
+
+def fromCoords(coords, name="custom"):
+    #Instance for a list of (x, y) points that did not come from a file
+    coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 2)
+    return tsplib.Instance(name, len(coords), None, coords=coords)
+
+
+def distances(instance, settings, scale, logger, shared=False):
+    #Distance object for the instance, shared=True puts matrices in shared memory for
+    #subprocesses to attach to
+    n = instance.dimension
+
+    if instance.explicit:
+        dist = distance.fromWeights(instance.weights * scale, dtype=settings.dtype, shared=shared)
+        if not dist.symmetric:
+            logger.info("Distance matrix is asymmetric, using directed storage")
+        return dist
+
+    metric = settings.metric or instance.metric("euclidean" if settings.coordinates else "haversine")
+    build = lambda out=None: distance.buildCondensed(instance.coords, metric, dtype=settings.dtype, scale=scale,
+                                                     workers=settings.workers, out=out, shared=shared)
+    required = distance.matrixBytes(n, settings.dtype)
+
+    if required > settings.memLimit:
+        #Too large to hold in memory, fall back to evaluating distances from coordinates
+        logger.info("Distance matrix would need {:.0f}MB, using matrix free evaluation".format(required / (1 << 20)))
+        return distance.CoordinateDistance(instance.coords, metric, dtype=settings.dtype, scale=scale)
+
+    if settings.cache is not None and instance.source is not None:
+        key = ("condensed", metric, scale, settings.dtype)
+        data, hit = settings.cache.load(instance.source, key, (n * (n - 1) // 2,), settings.dtype, build)
+        if hit:
+            logger.info("Distance matrix loaded from cache")
+        return distance.CondensedMatrix(data)
+
+    return build()
+
+
+def candidates(instance, dist, settings, logger):
+    #Nearest neighbour candidate lists, None when switched off
+    if settings.neighbours < 1:
+        return None
+
+    if instance.explicit:
+        near = neighbours.fromDistance(dist, settings.neighbours)
+    else:
+        near = neighbours.fromCoords(instance.coords, settings.neighbours)
+
+    logger.info("Built {} nearest neighbour candidate lists".format(len(near)))
+    return near
@@ -0,0 +1,112 @@
+#Module with the local search used to polish tours
+#
+#twoOpt is 2-opt restricted to candidate edges: a city is only reconnected to one of
+#its k nearest neighbours, and the scan of that list stops at the first neighbour
+#farther away than the tour edge being replaced. Cities are taken from a work queue
+#and the first one with an improving move gets its best one applied. A city whose
+#neighbourhood has no improving move drops out (its don't-look bit is set) until one
+#of its tour edges changes and puts it back in. The tour is handled as a cycle and
+#each move reverses the shorter side of it
+from collections import deque
+
+import numpy as np
+
+import neighbours
+
+#Moves have to save more than this, keeps rounding noise from cycling forever
+EPSILON = 1e-9
+
+
+def twoOpt(route, dist, candidates=None, maxMoves=None):
+    #Improve a closed route. Returns the route (a list starting and ending at the depot)
+    #and the length saved. Reversing a segment changes every directed edge inside it,
+    #so routes on asymmetric matrices come back untouched
+    route = route.tolist() if isinstance(route, np.ndarray) else list(route)
+    if not dist.symmetric or len(route) < 5:
+        return route, 0
+
+    if candidates is None:
+        candidates = neighbours.fromDistance(dist, 8)
+    #Callers running it many times can pass the lists already converted
+    near = candidates if isinstance(candidates, list) else np.asarray(candidates).tolist()
+
+    depot = route[0]
+    tour = route[:-1]
+    n = len(tour)
+    pos = [0] * len(near)
+    for i, city in enumerate(tour):
+        pos[city] = i
+
+    def reverse(i, j):
+        #Reverse tour[i..j] going forward around the cycle, or the rest of the cycle
+        #when that is shorter, it gives the same tour
+        length = (j - i) % n + 1
+        if 2 * length > n:
+            i, j = (j + 1) % n, (i - 1) % n
+            length = n - length
+        for _ in range(length // 2):
+            x, y = tour[i], tour[j]
+            tour[i], tour[j] = y, x
+            pos[y], pos[x] = i, j
+            i = i + 1 if i + 1 < n else 0
+            j = j - 1 if j > 0 else n - 1
+
+    d = dist.d
+    queue = deque()
+    queued = bytearray(len(near))
+    gain = 0
+    moves = 0
+    swept = -1
+
+    while moves != swept and (maxMoves is None or moves < maxMoves):
+        #Every city goes back in the queue until a sweep ends without a move, the
+        #don't-look bits alone miss moves opened up by far away changes
+        swept = moves
+        queue.extend(tour)
+        for city in tour:
+            queued[city] = 1
+
+        while queue and (maxMoves is None or moves < maxMoves):
+            a = queue.popleft()
+            queued[a] = 0
+            pa = pos[a]
+
+            #Best move around a: tour edge (a, b) goes out, (a, c) and (b, e) come in
+            #for the edge (c, e) on the same side of c
+            move = None
+            for forward in (True, False):
+                b = tour[pa + 1 if pa + 1 < n else 0] if forward else tour[pa - 1]
+                dab = d(a, b)
+
+                for c in near[a]:
+                    dac = d(a, c)
+                    if dac >= dab:
+                        break
+                    pc = pos[c]
+                    e = tour[pc + 1 if pc + 1 < n else 0] if forward else tour[pc - 1]
+                    if e == a:
+                        continue
+                    delta = dac + d(b, e) - dab - d(c, e)
+                    if delta < -EPSILON and (move is None or delta < move[4]):
+                        move = (forward, b, c, e, delta)
+
+            if move is None:
+                continue
+
+            forward, b, c, e, delta = move
+            if forward:
+                reverse(pos[b], pos[c])     #a b ... c e  ->  a c ... b e
+            else:
+                reverse(pos[a], pos[e])     #b a ... e c  ->  b e ... a c
+
+            gain -= delta
+            moves += 1
+            for city in (a, b, c, e):
+                if not queued[city]:
+                    queued[city] = 1
+                    queue.append(city)
+
+        queue.clear()
+
+    i = pos[depot]
+    return tour[i:] + tour[:i] + [depot], gain
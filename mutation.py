@@ -1,26 +1,297 @@
 #Module to perform Mutation in Genetic Algorithm 
+#
+#Every operator mutates the individual in place and returns (individual, delta).
+#When a distance object is passed delta is the exact change in tour length, computed
+#from the edges the operator touched, otherwise it is None
 import random
 from math import ceil
 
-def Twors(individual):
+import numpy as np
+
+import distance
+import kernels
+import neighbours
+import operators
+
+@operators.mutation()
+def Twors(individual, candidates=None, dist=None):
     #Simple swap mutation where to genes are swapped to create a new gene
     size = len(individual)
-    a = random.randint(1,size-3)
-    b = random.randint(a+1, size-2)
+    a = b = None
+
+    if candidates is not None:
+        #Swap a candidate neighbour of individual[a-1] into position a
+        a = random.randint(1, size-2)
+        near = candidates[individual[a-1]]
+        b = neighbours.position(individual, near[random.randrange(len(near))])
+        if not (1 <= b <= size-2 and a != b):
+            a = b = None
+
+    if a is None:
+        a = random.randint(1,size-3)
+        b = random.randint(a+1, size-2)
+
+    edges = sorted({a-1, a, b-1, b})
+    before = distance.edgeSum(dist, individual, edges) if dist is not None else None
+
     individual[a], individual[b] =  individual[b], individual[a]
-    return (individual)
+
+    if dist is None:
+        return individual, None
+    return individual, distance.edgeSum(dist, individual, edges) - before
 
 
-def RSM(individual):
+@operators.mutation()
+def RSM(individual, candidates=None, dist=None):
     #Reverse Sequence Mutation: A subset of the individual is reversed to produce variation
     size = len(individual)
-    a = random.randint(1,size-4)
-    b = random.randint(a, size-2)
+
+    segment = None
+    if candidates is not None:
+        #Reverse the segment that joins a city with one of its nearest neighbours
+        segment = neighbours.candidateSegment(individual, candidates)
+
+    if segment is not None:
+        a, b = segment
+    else:
+        a = random.randint(1,size-4)
+        b = random.randint(a, size-2)
     # a = random.randint(1,int(size/4)-1)
     # b = random.randint(a, int(size/4))
     
+    #Only the two boundary edges change on a symmetric matrix, directed edges inside
+    #the segment flip as well
+    before = None
+    if dist is not None:
+        edges = [a-1, b] if dist.symmetric else list(range(a-1, b+1))
+        before = distance.edgeSum(dist, individual, edges)
+
+    if kernels.active and isinstance(individual, np.ndarray):
+        kernels.reverseSegment(individual, a, b)
+    else:
+        for i in range(ceil((b-a)/2)):
+            individual[a+i], individual[b-i] = individual[b-i], individual[a+i]
     
-    for i in range(ceil((b-a)/2)):
-        individual[a+i], individual[b-i] = individual[b-i], individual[a+i]
-    
-    return (individual)
+    if dist is None:
+        return individual, None
+    return individual, distance.edgeSum(dist, individual, edges) - before
+
+
+def moveDelta(dist, individual, a, b, q, reverse):
+    #Change in length from moving individual[a..b] in between positions q and q+1,
+    #reversed or not. Only the three edges around the cut points change, plus the ones
+    #inside the segment when a reversed segment is on an asymmetric matrix
+    d = dist.d
+    prev, first, last, after = individual[a-1], individual[a], individual[b], individual[b+1]
+    x, y = individual[q], individual[q+1]
+
+    delta = d(prev, after) - d(prev, first) - d(last, after) - d(x, y)
+    if reverse:
+        delta += d(x, last) + d(first, y)
+        if not dist.symmetric:
+            for i in range(a, b):
+                delta += d(individual[i+1], individual[i]) - d(individual[i], individual[i+1])
+    else:
+        delta += d(x, first) + d(last, y)
+
+    return delta
+
+
+def moveSegment(individual, a, b, q, reverse=False):
+    #In place move of individual[a..b] in between positions q and q+1, q outside [a-1, b]
+    segment = list(individual[a:b+1])
+    if reverse:
+        segment.reverse()
+
+    if q > b:
+        individual[a:q+1] = list(individual[b+1:q+1]) + segment
+    else:
+        individual[q+1:b+1] = segment + list(individual[q+1:a])
+
+    return individual
+
+
+def placeSegment(individual, a, b, q, dist):
+    #Move the segment to q in the cheaper orientation when the distances are known,
+    #a random one otherwise. Returns (individual, delta)
+    if dist is None:
+        return moveSegment(individual, a, b, q, random.random() < 0.5), None
+
+    forward = moveDelta(dist, individual, a, b, q, False)
+    backward = moveDelta(dist, individual, a, b, q, True) if b > a else forward
+    reverse = backward < forward
+
+    return moveSegment(individual, a, b, q, reverse), min(forward, backward)
+
+
+@operators.mutation()
+def OrOpt(individual, candidates=None, dist=None):
+    #Or-opt: a chain of 1-3 cities is cut out and reinserted elsewhere, possibly reversed.
+    #With candidate lists it goes next to a candidate neighbour of its first city
+    size = len(individual)
+    length = random.randint(1, min(3, size-3))
+    a = random.randint(1, size-1-length)
+    b = a + length - 1
+
+    q = None
+    if candidates is not None:
+        near = candidates[individual[a]]
+        q = neighbours.position(individual, near[random.randrange(len(near))])
+        if q > size-2 or a-1 <= q <= b:
+            q = None
+
+    if q is None:
+        #Any edge outside [a-1, b]
+        free = (a-1) + (size-2-b)
+        if free == 0:
+            return individual, (0 if dist is not None else None)
+        q = random.randrange(free)
+        if q >= a-1:
+            q += b+1 - (a-1)
+
+    return placeSegment(individual, a, b, q, dist)
+
+
+@operators.mutation()
+def Insertion(individual, candidates=None, dist=None):
+    #Insertion mutation: one city is moved right before or right after one of its
+    #candidate neighbours, on whichever side is shorter when the distances are known.
+    #Without candidate lists it goes in between two random neighbours
+    size = len(individual)
+    p = random.randint(1, size-2)
+
+    options = []
+    if candidates is not None:
+        near = candidates[individual[p]]
+        j = neighbours.position(individual, near[random.randrange(len(near))])
+        #After the candidate, or before it (the depot is also the last city)
+        options = [q for q in (j, (j if j > 0 else size-1) - 1) if q <= size-2 and not p-1 <= q <= p]
+
+    if not options:
+        q = random.randint(0, size-4)
+        if q >= p-1:
+            q += 2
+        options = [q]
+
+    if dist is None:
+        return moveSegment(individual, p, p, random.choice(options)), None
+
+    deltas = [moveDelta(dist, individual, p, p, q, False) for q in options]
+    best = deltas.index(min(deltas))
+    return moveSegment(individual, p, p, options[best]), deltas[best]
+
+
+#Whole generation variants. They mutate a 2-D array of closed routes in place: every
+#row is picked with probability rate and all positions are drawn together. They return
+#the indices of the mutated rows and, when dist is given, the exact change in length of
+#each, otherwise None
+
+
+def candidatePairs(routes, candidates):
+    #candidateSegment's draw for every row at once: a position i and the position j of a
+    #random candidate neighbour of routes[r, i-1], -1 when that candidate is the depot
+    k, size = routes.shape
+    rows = np.arange(k)
+
+    i = np.random.randint(1, size-1, size=k)
+    c = candidates[routes[rows, i-1], np.random.randint(0, candidates.shape[1], size=k)]
+    j = neighbours.positions(routes)[rows, c]
+    j[c == routes[:, 0]] = -1
+
+    return i, j
+
+
+def rowEdges(dist, routes, edges):
+    #Per row sum of the edges routes[r, e] -> routes[r, e+1] for the columns of edges,
+    #entries of -1 are skipped
+    rows = np.arange(len(routes))[:, None]
+    e = np.maximum(edges, 0)
+    w = dist.pairs(routes[rows, e], routes[rows, e+1])
+    return distance.total(np.where(edges >= 0, w, 0), axis=1)
+
+
+@operators.batched("RSM", "mutation")
+def batchRSM(routes, rate, candidates=None, dist=None):
+    k, size = routes.shape
+    rows = np.flatnonzero(np.random.random(k) < rate)
+    if len(rows) == 0:
+        return rows, (None if dist is None else np.zeros(0))
+
+    sub = routes[rows]
+    m = len(rows)
+
+    a = np.random.randint(1, size-3, size=m)
+    b = a + (np.random.random(m) * (size-1-a)).astype(np.intp)
+
+    if candidates is not None:
+        i, j = candidatePairs(sub, candidates)
+        ca = np.where(j > i, i, j+1)
+        cb = np.where(j > i, j, i-1)
+        ok = (j >= 0) & (ca >= 1) & (cb <= size-2) & (ca < cb)
+        a = np.where(ok, ca, a)
+        b = np.where(ok, cb, b)
+
+    #Every row reversed at once by reading its segment backwards
+    cols = np.arange(size)
+    a, b = a[:, None], b[:, None]
+    index = np.where((cols >= a) & (cols <= b), a + b - cols, cols)
+    mutated = np.take_along_axis(sub, index, axis=1)
+
+    deltas = None
+    if dist is not None:
+        if dist.symmetric:
+            edges = np.hstack([a-1, b])
+            deltas = rowEdges(dist, mutated, edges) - rowEdges(dist, sub, edges)
+        else:
+            deltas = dist.tours(mutated) - dist.tours(sub)
+
+    routes[rows] = mutated
+    return rows, deltas
+
+
+@operators.batched("Twors", "mutation")
+def batchTwors(routes, rate, candidates=None, dist=None):
+    k, size = routes.shape
+    rows = np.flatnonzero(np.random.random(k) < rate)
+    if len(rows) == 0:
+        return rows, (None if dist is None else np.zeros(0))
+
+    sub = routes[rows]
+    m = len(rows)
+    r = np.arange(m)
+
+    a = np.random.randint(1, size-2, size=m)
+    b = a + 1 + (np.random.random(m) * (size-2-a)).astype(np.intp)
+
+    if candidates is not None:
+        i, j = candidatePairs(sub, candidates)
+        ok = (j >= 1) & (j <= size-2) & (j != i)
+        a = np.where(ok, np.minimum(i, j), a)
+        b = np.where(ok, np.maximum(i, j), b)
+
+    #Edges around both positions, the middle one only once when they are adjacent
+    edges = np.stack([a-1, a, np.where(b-1 > a, b-1, -1), b], axis=1)
+    before = rowEdges(dist, sub, edges) if dist is not None else None
+
+    sub[r, a], sub[r, b] = sub[r, b], sub[r, a].copy()
+
+    deltas = None
+    if dist is not None:
+        deltas = rowEdges(dist, sub, edges) - before
+
+    routes[rows] = sub
+    return rows, deltas
+
+
+def eachRow(operator):
+    #Whole generation variant of a single route operator: the drawn rows go through it
+    #one at a time
+    def batch(routes, rate, candidates=None, dist=None):
+        rows = np.flatnonzero(np.random.random(len(routes)) < rate)
+        deltas = [operator(routes[r], candidates, dist)[1] for r in rows]
+        return rows, (None if dist is None else np.array(deltas, dtype=np.float64))
+    return batch
+
+
+operators.batched("OrOpt", "mutation")(eachRow(OrOpt))
+operators.batched("Insertion", "mutation")(eachRow(Insertion))
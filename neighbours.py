@@ -0,0 +1,128 @@
+#Module to build k-nearest-neighbour candidate lists
+#
+#candidates[c] holds the k cities closest to city c, nearest first, as an (n, k)
+#int32 array. Move generators use it to propose edges between nearby cities instead
+#of picking segment endpoints uniformly at random
+import random
+
+import numpy as np
+
+#Average number of cities per grid cell
+CELL_OCCUPANCY = 8
+
+
+def fromCoords(coords, k):
+    #Uniform grid search. Each cell queries the ring of cells around it and widens the
+    #ring until the k-th neighbour found is provably closer than anything outside it.
+    #Distances are planar, exact for EUC_2D/ATT and a close proxy for GEO
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    n = len(coords)
+    k = min(k, n - 1)
+
+    lo = coords.min(axis=0)
+    span = np.maximum(coords.max(axis=0) - lo, 1e-12)
+    side = max(1, int(np.sqrt(n / CELL_OCCUPANCY)))
+    h = max(span) / side
+    shape = np.maximum(1, np.ceil(span / h).astype(np.int64))
+
+    cell = np.minimum(((coords - lo) / h).astype(np.int64), shape - 1)
+    cellId = cell[:, 0] * shape[1] + cell[:, 1]
+
+    order = np.argsort(cellId, kind="stable")
+    start = np.searchsorted(cellId[order], np.arange(shape[0] * shape[1] + 1))
+
+    candidates = np.empty((n, k), dtype=np.int32)
+
+    for cid in np.unique(cellId):
+        members = order[start[cid]:start[cid + 1]]
+        cx, cy = divmod(int(cid), int(shape[1]))
+        pending = members
+        r = 1
+
+        while len(pending):
+            x0, x1 = max(cx - r, 0), min(cx + r, shape[0] - 1)
+            y0, y1 = max(cy - r, 0), min(cy + r, shape[1] - 1)
+            pool = np.concatenate([order[start[x * shape[1] + y0]:start[x * shape[1] + y1 + 1]] for x in range(x0, x1 + 1)])
+
+            covered = x0 == 0 and y0 == 0 and x1 == shape[0] - 1 and y1 == shape[1] - 1
+            if len(pool) <= k and not covered:
+                r += 1
+                continue
+
+            diff = coords[pending][:, None, :] - coords[pool][None, :, :]
+            d = np.einsum("ijk,ijk->ij", diff, diff)
+            d[pool[None, :] == pending[:, None]] = np.inf
+
+            nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+            dk = np.take_along_axis(d, nearest, axis=1)
+            rank = np.argsort(dk, axis=1)
+            nearest = np.take_along_axis(nearest, rank, axis=1)
+            dk = np.take_along_axis(dk, rank, axis=1)
+
+            #Anything outside the ring is at least r*h away
+            done = covered | (dk[:, -1] <= (r * h) ** 2)
+            candidates[pending[done]] = pool[nearest[done]]
+
+            pending = pending[~done]
+            r += 1
+
+    return candidates
+
+
+def fromDistance(dist, k, rows=256):
+    #Row wise selection for explicit matrices, works with any distance object
+    n = dist.n
+    k = min(k, n - 1)
+    everyone = np.arange(n)
+    candidates = np.empty((n, k), dtype=np.int32)
+
+    for i in range(0, n, rows):
+        block = np.arange(i, min(i + rows, n))
+        d = dist.pairs(np.repeat(block, n), np.tile(everyone, len(block))).reshape(len(block), n).astype(np.float64)
+        d[np.arange(len(block)), block] = np.inf
+
+        nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+        rank = np.argsort(np.take_along_axis(d, nearest, axis=1), axis=1)
+        candidates[block] = np.take_along_axis(nearest, rank, axis=1)
+
+    return candidates
+
+
+def position(route, city):
+    #First index of city in a list or array route
+    if isinstance(route, list):
+        return route.index(city)
+    return int(np.flatnonzero(np.asarray(route) == city)[0])
+
+
+def positions(routes):
+    #pos[r, c] is the index of city c in the open part of closed routes[r], for a 2-D
+    #array of routes
+    k, size = routes.shape
+    pos = np.empty((k, routes.max() + 1), dtype=np.intp)
+    pos[np.arange(k)[:, None], routes[:, :-1]] = np.arange(size - 1)
+    return pos
+
+
+def candidateSegment(route, candidates):
+    #Pick a segment [a, b] whose reversal makes a city adjacent to one of its
+    #candidate neighbours. Positions 0 and len-1 hold the depot and are never moved.
+    #Returns None when the drawn pair cannot form a valid segment
+    size = len(route)
+    i = random.randint(1, size - 2)
+    city = route[i - 1]
+    c = int(candidates[city][random.randrange(len(candidates[city]))])
+
+    if c == route[0]:
+        return None
+
+    j = position(route, c)
+
+    if j > i:
+        a, b = i, j                 #route[i-1] gets followed by c
+    else:
+        a, b = j + 1, i - 1         #c gets followed by route[i-1]
+
+    if a < 1 or b > size - 2 or a >= b:
+        return None
+    return a, b
@@ -0,0 +1,96 @@
+#Registry of the genetic operators
+#
+#crossover.py and mutation.py register their operators with the decorators below.
+#The scripts resolve the configured names once at startup and call the Operator they
+#get back, which counts its calls and CPU time. Once the offspring lengths are known
+#the script credits the operator with how much shorter the offspring came out than
+#what it started from, so the run summary shows which operators pay for themselves
+from time import process_time
+
+registry = {"crossover": {}, "mutation": {}}
+
+
+class Operator:
+
+    def __init__(self, kind, name, fn, context=False):
+        self.kind = kind
+        self.name = name
+        self.fn = fn
+        self.context = context      #Takes the distance object and candidate lists
+        self.batch = None           #Whole generation variant
+
+        self.calls = 0
+        self.time = 0.0
+        self.offspring = 0
+        self.gain = 0.0
+
+    def __call__(self, *args, dist=None, candidates=None):
+        extra = {"dist": dist, "candidates": candidates} if self.context else {}
+        start = process_time()
+        try:
+            return self.fn(*args, **extra)
+        finally:
+            self.time += process_time() - start
+            self.calls += 1
+
+    def crossBatch(self, parentsA, parentsB):
+        start = process_time()
+        try:
+            return self.batch(parentsA, parentsB)
+        finally:
+            self.time += process_time() - start
+            self.calls += len(parentsA)
+
+    def mutateBatch(self, routes, rate, candidates=None, dist=None):
+        start = process_time()
+        try:
+            rows, deltas = self.batch(routes, rate, candidates, dist)
+        finally:
+            self.time += process_time() - start
+        self.calls += len(rows)
+        return rows, deltas
+
+    def credit(self, gain, offspring=1):
+        #gain is the length the offspring saved, negative when they got longer
+        self.offspring += offspring
+        self.gain += gain
+
+    def summary(self, scale=1):
+        mean = self.gain / self.offspring / scale if self.offspring else 0.0
+        rate = self.gain / scale / self.time if self.time > 0 else 0.0
+        return "{} {}: {} calls, {:.3f}s CPU, {} offspring, mean gain {:.4f}, gain per CPU second {:.2f}".format(
+            self.kind, self.name, self.calls, self.time, self.offspring, mean, rate)
+
+
+def register(kind, name=None, context=False):
+    def wrap(fn):
+        key = name or fn.__name__
+        registry[kind][key] = Operator(kind, key, fn, context)
+        return fn
+    return wrap
+
+
+def crossover(name=None, context=False):
+    return register("crossover", name, context)
+
+
+def mutation(name=None):
+    return register("mutation", name)
+
+
+def batched(name, kind="crossover"):
+    #Registers fn as the whole generation variant of the operator called name
+    def wrap(fn):
+        registry[kind][name].batch = fn
+        return fn
+    return wrap
+
+
+def resolve(kind, name):
+    #The registered Operator, None when nothing goes by that name
+    return registry[kind].get(name)
+
+
+def summary(scale=1):
+    #One line per operator that was used during the run
+    return [op.summary(scale) for ops in registry.values() for op in ops.values() if op.calls]
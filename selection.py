@@ -0,0 +1,58 @@
+#Module to perform parent Selection in Genetic Algorithm
+#
+#Every operator draws all the parents of a generation at once and returns their
+#positions in the population as an array of indices, the rows are not copied
+import numpy as np
+
+
+def roulette(fitness, count):
+    #Roulette wheel selection: an individual is picked with a probability equal to its
+    #share of the (normalised) fitness. The wheel is the cumulative sum of the fitness,
+    #every draw is a binary search for the first slot reaching the random number
+    wheel = np.cumsum(fitness)
+    r = np.random.random(count) * wheel[-1]
+    index = np.searchsorted(wheel, r, side='left')
+
+    #Rounding can leave the last slot a hair short of r
+    return np.minimum(index, len(wheel) - 1)
+
+
+def tournament(fitness, count, size=3):
+    #Tournament selection: each parent is the fittest of size individuals drawn at
+    #random. Pressure depends only on the ordering, not on how close the lengths are
+    fitness = np.asarray(fitness)
+    entrants = np.random.randint(0, len(fitness), size=(count, max(1, size)))
+    winner = np.argmax(fitness[entrants], axis=1)
+
+    return entrants[np.arange(count), winner]
+
+
+def rank(fitness, count, pressure=1.5):
+    #Linear rank selection: the roulette wheel is built on the rank of an individual
+    #instead of its fitness. The fittest is pressure times as likely to be picked as the
+    #average individual (1 < pressure <= 2)
+    fitness = np.asarray(fitness)
+    n = len(fitness)
+    if n == 1:
+        return np.zeros(count, dtype=np.intp)
+
+    order = np.argsort(fitness, kind='stable')          #Worst first
+    weight = (2 - pressure) / n + 2 * np.arange(n) * (pressure - 1) / (n * (n - 1))
+
+    return order[roulette(weight, count)]
+
+
+def SUS(fitness, count):
+    #Stochastic Universal Sampling: count equally spaced pointers with a single random
+    #offset are laid over the roulette wheel, so every individual gets within one of its
+    #expected number of copies. The picks come out in population order and are shuffled
+    #so consecutive parents are not neighbours on the wheel
+    if count == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    wheel = np.cumsum(fitness)
+    step = wheel[-1] / count
+    pointers = np.random.random() * step + step * np.arange(count)
+    index = np.minimum(np.searchsorted(wheel, pointers, side='left'), len(wheel) - 1)
+
+    return np.random.permutation(index)
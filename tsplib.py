@@ -0,0 +1,277 @@
+#Module to read TSPLIB instances and the plain dataset files shipped in ./dataset
+#
+#Supported layouts:
+#   TSPLIB files with a specification part followed by NODE_COORD_SECTION or
+#   EDGE_WEIGHT_SECTION (FULL_MATRIX, UPPER_ROW, LOWER_ROW, UPPER_DIAG_ROW,
+#   LOWER_DIAG_ROW and their column counterparts)
+#   Headerless "id x y" coordinate files
+#   Headerless explicit matrices, optionally preceded by a line holding the dimension
+#
+#Any of them can be converted to a binary .tspb file with convert.py. load() prefers
+#the binary file when it is up to date and memory maps its arrays instead of parsing
+import json
+import os
+import re
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 22
+
+#Distance metric in distance.METRICS for each coordinate EDGE_WEIGHT_TYPE
+METRIC_NAMES = {
+    "EUC_2D": "euclidean",
+    "CEIL_2D": "ceil2d",
+    "ATT": "att",
+    "GEO": "geo",
+}
+
+#Column orders of a symmetric matrix read the same as the opposite row order
+FORMAT_ALIASES = {
+    "UPPER_COL": "LOWER_ROW",
+    "LOWER_COL": "UPPER_ROW",
+    "UPPER_DIAG_COL": "LOWER_DIAG_ROW",
+    "LOWER_DIAG_COL": "UPPER_DIAG_ROW",
+}
+
+KEYWORD = re.compile(r"^[ \t]*[A-Z][A-Z_]+", re.M)
+
+#Binary layout: magic, little endian uint64 header length, JSON header, then every
+#array stored raw at the offset recorded in the header
+BINARY_MAGIC = b"TSPBIN01"
+BINARY_EXT = ".tspb"
+ALIGN = 64
+
+
+class Instance:
+
+    def __init__(self, name, dimension, edgeWeightType, edgeWeightFormat=None, coords=None, weights=None, source=None):
+        self.name = name
+        self.dimension = dimension
+        self.edgeWeightType = edgeWeightType
+        self.edgeWeightFormat = edgeWeightFormat
+        self.coords = coords        #(n, 2) float64 or None
+        self.weights = weights      #(n, n) explicit matrix or None
+        self.source = source        #File the instance was read from
+
+    @property
+    def explicit(self):
+        return self.weights is not None
+
+    def metric(self, default="euclidean"):
+        #Headerless coordinate files do not say how to measure, the caller decides
+        return METRIC_NAMES.get(self.edgeWeightType, default)
+
+
+def readNumbers(f, head=""):
+    #Parse whitespace separated numbers in large chunks until EOF or the next keyword.
+    #Tokens split across a chunk boundary are carried over to the next chunk
+    blocks = []
+    tail = head
+
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        text = tail + chunk
+
+        stop = KEYWORD.search(text)
+        if stop is not None:
+            text = text[:stop.start()]
+            chunk = ""
+
+        if chunk:
+            cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+            text, tail = text[:cut + 1], text[cut + 1:]
+        else:
+            tail = ""
+
+        if text.strip():
+            blocks.append(np.fromstring(text, sep=" "))
+
+        if not chunk:
+            break
+
+    if not blocks:
+        return np.empty(0)
+    return np.concatenate(blocks)
+
+
+def squareFromValues(values, n, fmt):
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    expected = {
+        "FULL_MATRIX": n * n,
+        "UPPER_ROW": n * (n - 1) // 2,
+        "LOWER_ROW": n * (n - 1) // 2,
+        "UPPER_DIAG_ROW": n * (n + 1) // 2,
+        "LOWER_DIAG_ROW": n * (n + 1) // 2,
+    }
+    if fmt not in expected:
+        raise ValueError("Unsupported EDGE_WEIGHT_FORMAT: {}".format(fmt))
+    if len(values) != expected[fmt]:
+        raise ValueError("{} matrix of dimension {} needs {} values, found {}".format(fmt, n, expected[fmt], len(values)))
+
+    if fmt == "FULL_MATRIX":
+        return values.reshape(n, n)
+
+    weights = np.zeros((n, n), dtype=values.dtype)
+    if fmt == "UPPER_ROW":
+        weights[np.triu_indices(n, 1)] = values
+    elif fmt == "LOWER_ROW":
+        weights[np.tril_indices(n, -1)] = values
+    elif fmt == "UPPER_DIAG_ROW":
+        weights[np.triu_indices(n)] = values
+    else:
+        weights[np.tril_indices(n)] = values
+
+    #Mirror the stored triangle
+    return np.where(weights != 0, weights, weights.T)
+
+
+def guessFormat(count, n=None):
+    #Layout of a headerless matrix, judged by how many values it holds
+    if n is None:
+        n = int(round(np.sqrt(count)))
+        if n * n != count:
+            raise ValueError("Cannot infer the dimension of a matrix with {} values".format(count))
+        return n, "FULL_MATRIX"
+
+    for fmt in ("FULL_MATRIX", "LOWER_DIAG_ROW", "UPPER_ROW"):
+        size = {"FULL_MATRIX": n * n, "LOWER_DIAG_ROW": n * (n + 1) // 2, "UPPER_ROW": n * (n - 1) // 2}[fmt]
+        if size == count:
+            return n, fmt
+    raise ValueError("Matrix of dimension {} cannot hold {} values".format(n, count))
+
+
+def read(fname, explicit=None):
+    #explicit tells how to interpret a headerless file, TSPLIB headers take precedence.
+    #None guesses from the first line, coordinate files hold exactly "id x y" per line
+    spec = {}
+    name = re.sub(r"\.[^.]*$", "", fname.replace("\\", "/").split("/")[-1])
+
+    with open(fname, "r") as f:
+        section = None
+        head = ""
+
+        while True:
+            line = f.readline()
+            if not line:
+                break
+
+            stripped = line.strip()
+            if not stripped:
+                continue
+
+            if stripped.endswith("_SECTION") or stripped == "EOF":
+                section = stripped
+                break
+
+            key, sep, value = stripped.partition(":")
+            if sep and not re.match(r"^[-+.\d]", key):
+                spec[key.strip().upper()] = value.strip()
+                continue
+
+            #First numeric line of a headerless file
+            head = line
+            break
+
+        if section == "EOF":
+            raise ValueError("{} holds no data section".format(fname))
+
+        if explicit is None:
+            explicit = len(head.split()) != 3
+
+        if section == "EDGE_WEIGHT_SECTION" or (section is None and explicit):
+            n = int(spec["DIMENSION"]) if "DIMENSION" in spec else None
+            fmt = spec.get("EDGE_WEIGHT_FORMAT")
+
+            #Plain matrices in ./dataset may start with a line holding the dimension
+            if section is None and len(head.split()) == 1:
+                n = int(float(head))
+                head = ""
+
+            values = readNumbers(f, head)
+            if fmt is None:
+                n, fmt = guessFormat(len(values), n)
+
+            weights = squareFromValues(values, n, fmt)
+            return Instance(spec.get("NAME", name), n, spec.get("EDGE_WEIGHT_TYPE", "EXPLICIT"), fmt, weights=weights, source=fname)
+
+        if section not in (None, "NODE_COORD_SECTION"):
+            raise ValueError("Unsupported section {} in {}".format(section, fname))
+
+        values = readNumbers(f, head)
+
+    columns = 3
+    if values.size % columns != 0:
+        raise ValueError("{} does not hold 'id x y' rows".format(fname))
+
+    coords = np.ascontiguousarray(values.reshape(-1, columns)[:, 1:])
+    n = int(spec.get("DIMENSION", len(coords)))
+    if n != len(coords):
+        raise ValueError("DIMENSION is {} but {} coordinates were read".format(n, len(coords)))
+
+    return Instance(spec.get("NAME", name), n, spec.get("EDGE_WEIGHT_TYPE"), coords=coords, source=fname)
+
+
+def writeBinary(instance, fname):
+    arrays = {}
+    meta = {
+        "name": instance.name,
+        "dimension": instance.dimension,
+        "edgeWeightType": instance.edgeWeightType,
+        "edgeWeightFormat": instance.edgeWeightFormat,
+        "arrays": arrays,
+    }
+
+    present = [(key, np.ascontiguousarray(getattr(instance, key))) for key in ("coords", "weights")
+               if getattr(instance, key) is not None]
+
+    #Offsets depend on the header length, grow the reserved space until it fits
+    reserved = ALIGN
+    while True:
+        offset = reserved
+        for key, arr in present:
+            arrays[key] = {"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+            offset += -(-arr.nbytes // ALIGN) * ALIGN
+        header = json.dumps(meta).encode()
+        if 16 + len(header) <= reserved:
+            break
+        reserved = -(-(16 + len(header)) // ALIGN) * ALIGN
+
+    tmp = fname + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(BINARY_MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for key, arr in present:
+            f.seek(arrays[key]["offset"])
+            f.write(arr.tobytes())
+    os.replace(tmp, fname)
+
+
+def readBinary(fname):
+    with open(fname, "rb") as f:
+        if f.read(8) != BINARY_MAGIC:
+            raise ValueError("{} is not a binary instance file".format(fname))
+        size = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        meta = json.loads(f.read(size).decode())
+
+    arrays = {}
+    for key, spec in meta["arrays"].items():
+        arrays[key] = np.memmap(fname, dtype=np.dtype(spec["dtype"]), mode="r",
+                                offset=spec["offset"], shape=tuple(spec["shape"]))
+
+    return Instance(meta["name"], meta["dimension"], meta["edgeWeightType"], meta["edgeWeightFormat"],
+                    coords=arrays.get("coords"), weights=arrays.get("weights"), source=fname)
+
+
+def binaryName(fname):
+    return os.path.splitext(fname)[0] + BINARY_EXT
+
+
+def load(fname, explicit=None):
+    #Use the converted binary next to the text file unless the text file is newer
+    binary = binaryName(fname)
+    if os.path.exists(binary):
+        if not os.path.exists(fname) or os.path.getmtime(binary) >= os.path.getmtime(fname):
+            return readBinary(binary)
+
+    return read(fname, explicit)